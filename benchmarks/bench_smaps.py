@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+  Benchmark smaps parsing of show-mem against the original parser on a synthetic smaps file.
+  With --maps, benchmark parsing by mapping for `show-mem --maps` against the original parser, which only totals private
+  memory, to show the cost of keeping stats by mapping.
+
+  Usage: python benchmarks/bench_smaps.py [--maps] [mappings]  (defaults to 50k mappings)
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from memorytools.show_mem import KB, KB_NAME, MB, MB_NAME, _parse_smaps, _parse_smaps_mappings
+
+MAPPING = """{start:012x}-{end:012x} rw-p 00000000 00:00 0                          [anon:{index}]
+Size:                132 kB
+KernelPageSize:        4 kB
+MMUPageSize:           4 kB
+Rss:                 {rss} kB
+Pss:                 {pss} kB
+Pss_Dirty:           {pss} kB
+Shared_Clean:          0 kB
+Shared_Dirty:          0 kB
+Private_Clean:         4 kB
+Private_Dirty:       {private} kB
+Referenced:          {rss} kB
+Anonymous:           {rss} kB
+KSM:                   0 kB
+LazyFree:              0 kB
+AnonHugePages:         0 kB
+ShmemPmdMapped:        0 kB
+FilePmdMapped:         0 kB
+Shared_Hugetlb:        0 kB
+Private_Hugetlb:       0 kB
+Swap:                  8 kB
+SwapPss:               8 kB
+Locked:                0 kB
+THPeligible:           0
+ProtectionKey:         0
+VmFlags: rd wr mr mw me ac sd
+"""
+
+
+def legacy_get_private_mem(smaps):
+    total_private = 0
+
+    if smaps:
+        for line in smaps.split('\n'):
+            if line.startswith('Private_'):
+                name, amount, unit = line.split()
+
+                if unit == KB_NAME:
+                    total_private += int(amount) * KB
+                elif unit == MB_NAME:
+                    total_private += int(amount) * MB
+                else:
+                    raise Exception('Unsupported memory unit for Private_* memory info')
+
+    return total_private
+
+
+def legacy_parse(path):
+    with open(path) as fp:
+        return legacy_get_private_mem(fp.read())
+
+
+def current_parse(path):
+    with open(path, 'rb') as fp:
+        return _parse_smaps(fp)['private']
+
+
+def current_parse_mappings(path):
+    with open(path, 'rb', 0) as fp:
+        return _parse_smaps_mappings(fp)[0]['private']
+
+
+def best_time(func, path, repeat=5):
+    times = []
+
+    for _ in range(repeat):
+        start_time = time.time()
+        result = func(path)
+        times.append(time.time() - start_time)
+
+    return min(times), result
+
+
+def main(mappings, maps=False):
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        path = os.path.join(temp_dir, 'smaps')
+
+        with open(path, 'w') as fp:
+            for index in range(mappings):
+                start = 0x7f0000000000 + index * 0x21000
+                fp.write(MAPPING.format(start=start, end=start + 0x21000, index=index, rss=index % 132,
+                                        pss=index % 100, private=index % 128))
+
+        legacy_time, legacy_result = best_time(legacy_parse, path)
+        current_time, current_result = best_time(current_parse_mappings if maps else current_parse, path)
+
+        assert legacy_result == current_result
+
+        print('{0:,d} mappings, {1:.1f} MB smaps'.format(mappings, os.path.getsize(path) / float(MB)))
+        print('Legacy:  {0:.3f}s'.format(legacy_time))
+        print('Current: {0:.3f}s ({1:.1f}x)'.format(current_time, legacy_time / current_time))
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--maps']
+    main(int(args[0]) if args else 50000, maps='--maps' in sys.argv[1:])
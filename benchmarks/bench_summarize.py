@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+  Benchmark `_summarize_objects` against the original nested dict implementation.
+
+  Usage: python benchmarks/bench_summarize.py [count ...]  (defaults to 1M, 5M and 10M objects)
+"""
+
+import sys
+import time
+
+from memorytools import _summarize_objects
+
+
+def legacy_summarize_objects(objs):
+    objs_dict = {}
+
+    for obj in objs:
+        _legacy_incr(objs_dict, type(obj), 'count')
+        _legacy_incr(objs_dict, type(obj), 'size', sys.getsizeof(obj))
+
+    return objs_dict
+
+
+def _legacy_incr(objs_dict, kind, stat, value=1):
+    if kind not in objs_dict:
+        objs_dict[kind] = {}
+
+    if stat not in objs_dict[kind]:
+        objs_dict[kind][stat] = value
+    else:
+        objs_dict[kind][stat] += value
+
+
+class Custom(object):
+    pass
+
+
+def make_objects(count):
+    """ Mix of container types similar to what gc.get_objects() returns """
+    objs = []
+
+    for i in range(count):
+        kind = i % 5
+        if kind == 0:
+            objs.append([i])
+        elif kind == 1:
+            objs.append({'key': i})
+        elif kind == 2:
+            objs.append((i, str(i)))
+        elif kind == 3:
+            objs.append(set([i]))
+        else:
+            objs.append(Custom())
+
+    return objs
+
+
+def timed(func, objs):
+    start_time = time.time()
+    result = func(objs)
+    return time.time() - start_time, result
+
+
+def main(counts):
+    print('{0:>12s} {1:>10s} {2:>10s} {3:>8s}'.format('Objects', 'Legacy', 'Current', 'Speedup'))
+
+    for count in counts:
+        objs = make_objects(count)
+
+        legacy_time, legacy_result = timed(legacy_summarize_objects, objs)
+        current_time, current_result = timed(_summarize_objects, objs)
+
+        assert legacy_result == current_result
+
+        speedup = legacy_time / current_time
+        print('{0:>12,d} {1:>9.2f}s {2:>9.2f}s {3:>7.1f}x'.format(count, legacy_time, current_time, speedup))
+        del objs
+
+
+if __name__ == '__main__':
+    main([int(c) for c in sys.argv[1:]] or [1000000, 5000000, 10000000])
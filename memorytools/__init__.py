@@ -1,20 +1,84 @@
+from array import array
+from collections import Counter, deque, namedtuple
 import gc
+import heapq
 import locale
 import logging
+import math
 import os
+import random
 import signal
 import sys
+import threading
+import time
 import traceback
+import types
+
+import itertools
+
+try:
+    from itertools import imap, izip
+except ImportError:
+    imap, izip = map, zip
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+try:
+    from reprlib import Repr
+except ImportError:
+    from repr import Repr
 
-locale.setlocale(locale.LC_ALL, '')
 log = logging.getLogger(__name__)
 
+#: Buffer size for writing objects to file
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+#: Z-score for the 95% confidence error bounds of sampled estimates
+CONFIDENCE_Z = 1.96
+
+#: Repr instances by max_len to abbreviate containers before converting them to str in `save_objects`
+_reprs = {}
+
+#: Array typecode for sizes in `_iter_deep_sizes`, as 'l' is 32-bit on Windows and 'q' is not available in Python 2
+try:
+    SIZE_TYPECODE = array('q').typecode
+except ValueError:
+    SIZE_TYPECODE = 'l'
+
+#: Types of objects shared by the whole interpreter, which `deep_sizes` never charges to the objects that refer to them
+SHARED_TYPES = (type, getattr(types, 'ClassType', type), types.ModuleType, types.FunctionType,
+                types.BuiltinFunctionType, types.CodeType)
+
+#: Whether locale has been set from the environment by `_locale_format`
+_locale_set = False
+
+ObjectsSnapshot = namedtuple('ObjectsSnapshot', ['time', 'stats', 'ids'])
+SnapshotDiff = namedtuple('SnapshotDiff', ['types', 'new_ids'])
+TypeDelta = namedtuple('TypeDelta', ['kind', 'count', 'size'])
+TypeTrend = namedtuple('TypeTrend', ['kind', 'count_rate', 'size_rate'])
+Alert = namedtuple('Alert', ['name', 'value', 'rate'])
+
 
 def fmt(stat):
-    return locale.format('%d', stat, grouping=True)
+    return _locale_format('%d', stat)
 
 
-def add_debug_handler(sig=signal.SIGUSR2, log_stack=True, start_debugger_password=None):
+def _locale_format(format, num):
+    """ Format number with grouping of the user's locale, which is set on first use as it is slow to set at import """
+    global _locale_set
+
+    if not _locale_set:
+        locale.setlocale(locale.LC_ALL, '')
+        _locale_set = True
+
+    return locale.format_string(format, num, grouping=True)
+
+
+def add_debug_handler(sig=signal.SIGUSR2, log_stack=True, start_debugger_password=None, log_summary=False,
+                      save=False, all_threads=False, stacks_file=None):
     """
       Add a signal handler for debugging by logging a stack or starting rpdb2 debugger.
 
@@ -22,11 +86,64 @@ def add_debug_handler(sig=signal.SIGUSR2, log_stack=True, start_debugger_passwor
       :param bool log_stack: Log stacktrace when the signal is received. Useful to find where the program is stuck.
       :param str start_debugger_password: Password to start rpdb2 debugger. By default, this is not started / only starts if
                                           a password is provided. Note that this depends on `rpdb2` module in `winpdb` package.
+      :param bool log_summary: Log summary of gc objects from `summarize_objects` when the signal is received.
+      :param bool|dict save: Save gc objects using `save_objects` when the signal is received. Pass a dict to provide
+                             keyword args for `save_objects`, i.e. {'binary': True}
+      :param bool all_threads: Log stacks of all threads instead of only the main thread. Threads with identical stacks
+                               are logged once with a count, so this works as a poor man's profiler.
+      :param str stacks_file: Append stacks of all threads to this file in collapsed format (one line per stack with
+                              a count) whenever the signal is received. Sending the signal repeatedly samples stacks
+                              that can be turned into a flame graph, i.e. using flamegraph.pl
     """
+    heap_requested = None
+
+    if log_summary or save:
+        heap_requested = threading.Event()
+        save_kwargs = save if isinstance(save, dict) else {}
+
+        def heap_worker():
+            """ Summarize / save objects outside of the signal handler, coalescing signals received meanwhile """
+            while True:
+                heap_requested.wait()
+
+                try:
+                    if log_summary:
+                        log.info('Objects summary:\n%s', summarize_objects(echo=False))
+
+                    if save:
+                        save_objects(**save_kwargs)
+
+                except Exception:
+                    log.exception('Failed to summarize / save objects')
+
+                finally:
+                    heap_requested.clear()
+
+        worker = threading.Thread(target=heap_worker, name='memorytools-debug-handler')
+        worker.daemon = True
+        worker.start()
 
     def debug_handler(_, frame):
+        stacks = _thread_stacks(frame) if all_threads or stacks_file else None
+
         if log_stack:
-            log.info("Got SIGUSR2. Traceback:\n%s", ''.join(traceback.format_stack(frame)))
+            if all_threads:
+                log.info("Got SIGUSR2. Stacks of all threads:\n%s", _format_thread_stacks(stacks))
+            else:
+                log.info("Got SIGUSR2. Traceback:\n%s", ''.join(traceback.format_stack(frame)))
+
+        if stacks_file:
+            try:
+                with open(stacks_file, 'a') as fp:
+                    fp.write(_collapse_thread_stacks(stacks))
+            except Exception as e:
+                log.error('Could not write stacks to %s: %s', stacks_file, e)
+
+        if heap_requested:
+            if heap_requested.is_set():
+                log.info('Objects summary / save is already in progress, skipping')
+            else:
+                heap_requested.set()
 
         if start_debugger_password:
             try:
@@ -38,7 +155,56 @@ def add_debug_handler(sig=signal.SIGUSR2, log_stack=True, start_debugger_passwor
     signal.signal(sig, debug_handler)
 
 
-def save_objects(objs=None):
+def _thread_stacks(current_frame=None):
+    """
+      Stacks of all threads, grouped by identical stack.
+
+      :param frame current_frame: Frame to use for the current thread, i.e. the frame a signal handler interrupted.
+      :return: Map of stack (tuple of (filename, lineno, function name) from outermost frame) to list of thread names
+    """
+    names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+    frames = sys._current_frames()
+
+    if current_frame:
+        frames[threading.current_thread().ident] = current_frame
+
+    stacks = {}
+
+    for ident, frame in frames.items():
+        stack = []
+        while frame is not None:
+            stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+
+        stacks.setdefault(tuple(stack), []).append(names.get(ident, str(ident)))
+
+    return stacks
+
+
+def _format_thread_stacks(stacks):
+    """ Format stacks from `_thread_stacks`, most common stack first """
+    lines = []
+
+    for stack, names in sorted(stacks.items(), key=lambda s: (-len(s[1]), s[1])):
+        lines.append('%d thread%s (%s):\n' % (len(names), '' if len(names) == 1 else 's', ', '.join(sorted(names))))
+        lines.extend('  File "%s", line %d, in %s\n' % frame for frame in stack)
+
+    return ''.join(lines)
+
+
+def _collapse_thread_stacks(stacks):
+    """ Format stacks from `_thread_stacks` in collapsed format, i.e. "func (file:line);func2 (file:line) count" """
+    lines = []
+
+    for stack, names in stacks.items():
+        frames = ';'.join('%s (%s:%d)' % (name, filename, lineno) for filename, lineno, name in stack)
+        lines.append('%s %d\n' % (frames, len(names)))
+
+    return ''.join(lines)
+
+
+def save_objects(objs=None, limit=None, max_len=None, binary=False, referents=False, deep=False):
     """
       Save gc.get_objects() to /var/tmp/objects-$pid with summary on top,
       from `summarize_objects`.
@@ -50,52 +216,296 @@ def save_objects(objs=None):
       The above means array index 3648, 12568 bytes, data type dict, and data content as str.
       Easily go to the next record by searching for 'IDX '.
 
+      Records are streamed to the file as they are formatted. When `limit` is set, only the largest objects are
+      selected using a heap, so extra memory used is proportional to `limit` instead of the number of objects.
+
       :param list objs: gc objects to summarize. Defaults to gc.get_objects()
+      :param int limit: Only save the top N objects by size. Defaults to save all objects.
+      :param int max_len: Truncate the str of each object to this many characters. Containers are abbreviated
+                          before conversion, so a large dict is never fully converted to str.
+      :param bool binary: Save a compact binary snapshot to /var/tmp/objects-$pid.snapshot instead, which can be
+                          read using `memorytools.snapshot.Snapshot`. `limit` and `max_len` do not apply.
+      :param bool referents: Include ids of referents of each object in the binary snapshot.
+      :param bool deep: Order and report objects by inclusive size from `deep_sizes` instead, and include deep sizes
+                        in the summary.
     """
     if not objs:
         gc.collect()
         objs = gc.get_objects()
 
-    objs_sizes = sorted([(sys.getsizeof(o), i) for i, o in enumerate(objs)], reverse=True)
-    objs_size = sum([s[0] for s in objs_sizes])
+    if binary:
+        from memorytools.snapshot import write_snapshot
+
+        objs_file = '/var/tmp/objects-%s.snapshot' % os.getpid()
+        objs_size = write_snapshot(objs_file, objs, referents=referents)
+
+        msg = 'Wrote %d objects to %s (%d bytes)' % (len(objs), objs_file, objs_size)
+        print(msg)
+
+        return msg
+
+    objs_deep_sizes = deep_sizes(objs) if deep else None
+    sizes = _ObjectSizes(objs, objs_deep_sizes)
+
+    if limit:
+        objs_sizes = heapq.nlargest(limit, sizes)
+    else:
+        objs_sizes = sorted(sizes, reverse=True)
+
+    objs_size = sizes.total
     objs_file = '/var/tmp/objects-%s' % os.getpid()
 
-    with open(objs_file, 'w') as fp:
+    with open(objs_file, 'w', WRITE_BUFFER_SIZE) as fp:
         fp.write('Objects count: %s\n' % fmt(len(objs)))
         fp.write('Objects size: %s\n\n' % fmt(objs_size))
 
-        fp.write('Objects summary:\n%s\n\n' % summarize_objects(objs, echo=False, limit=20))
+        if deep:
+            fp.write('Objects deep size: %s\n\n' % fmt(sum(s[0] for s in objs_deep_sizes.values())))
+
+        summary = _format_summary(_summarize_objects(objs, deep=deep, objs_deep_sizes=objs_deep_sizes), echo=False,
+                                  limit=20)
+        fp.write('Objects summary:\n%s\n\n' % summary)
 
         for size, i in objs_sizes:
             try:
-                fp.write('IDX %d: %d %s %s\n' % (i, size, type(objs[i]), str(objs[i])))
+                fp.write('IDX %d: %d %s %s\n' % (i, size, type(objs[i]), _str(objs[i], max_len)))
             except Exception as e:
                 fp.write('IDX %d: %d %s EXCEPTION: %s\n' % (i, size, type(objs[i]), str(e)))
 
-    msg = 'Wrote %d objects to %s (%d bytes)' % (len(objs), objs_file, objs_size)
+    if len(objs_sizes) < len(objs):
+        msg = 'Wrote top %d of %d objects to %s (%d bytes)' % (len(objs_sizes), len(objs), objs_file, objs_size)
+    else:
+        msg = 'Wrote %d objects to %s (%d bytes)' % (len(objs), objs_file, objs_size)
     print(msg)
 
     return msg
 
 
-def summarize_objects(objs=None, echo=True, limit=10):
+class _ObjectSizes(object):
     """
-      Provide a summary of gc objects based on type. Two summaries: ordered by size, ordered by count
+      Iterate over (size, index) of objects while keeping a running total of their sizes. Size is the inclusive size
+      when deep sizes are given, but the total is always the sum of sys.getsizeof.
+    """
+
+    def __init__(self, objs, deep_sizes=None):
+        self.objs = objs
+        self.deep_sizes = deep_sizes
+        self.total = 0
+
+    def __iter__(self):
+        for i, obj in enumerate(self.objs):
+            size = sys.getsizeof(obj)
+            self.total += size
+
+            if self.deep_sizes is None:
+                yield size, i
+            else:
+                yield self.deep_sizes[id(obj)][1], i
+
+
+def _str(obj, max_len=None):
+    """ Convert object to str, truncated to `max_len` characters if set """
+    if max_len is None:
+        return str(obj)
+
+    if isinstance(obj, (dict, list, tuple, set, frozenset, deque)):
+        text = _get_repr(max_len).repr(obj)
+    else:
+        text = str(obj)
+
+    if len(text) > max_len:
+        text = text[:max_len] + '...'
+
+    return text
+
+
+def _get_repr(max_len):
+    """ :return: Repr that abbreviates containers to about `max_len` characters, assuming 4+ characters per item """
+    if max_len not in _reprs:
+        _repr = Repr()
+        _repr.maxstring = _repr.maxother = max(max_len, 3)
+        _repr.maxlong = max(max_len, 40)
+        _repr.maxlist = _repr.maxtuple = _repr.maxdict = _repr.maxset = _repr.maxfrozenset = _repr.maxdeque = \
+            _repr.maxarray = max(max_len // 4, 1)
+        _reprs[max_len] = _repr
+
+    return _reprs[max_len]
+
+
+def summarize_objects(objs=None, echo=True, limit=10, sample=None, deep=False):
+    """
+      Provide a summary of gc objects based on type. Two summaries: ordered by size, ordered by count.
+      With `deep`, a third summary ordered by inclusive size is added.
 
       :param list objs: gc objects to summarize. Defaults to gc.get_objects()
       :param bool echo: Print summary results to stdout if True, otherwise return results instead.
       :param int limit: Limit number of results in each summary. Defaults to show top 10.
+      :param float sample: Summarize a random sample of this fraction of objects (i.e. 0.01 for 1%) and extrapolate
+                           counts and sizes using `sample_objects` instead. gc.collect() is skipped when sampling.
+      :param bool deep: Include exclusive and inclusive sizes of each type from `deep_sizes`. ValueError is raised
+                       if sample is also set, as deep sizes need all objects.
       :return: Summary results if echo is False
     """
+    if sample and deep:
+        raise ValueError('Deep sizes are not supported with sample')
+
+    if sample:
+        return _format_summary(sample_objects(sample, objs=objs), echo=echo, limit=limit)
+
     if not objs:
         gc.collect()
         objs = gc.get_objects()
 
-    objs_dict = _summarize_objects(objs)
+    return _format_summary(_summarize_objects(objs, deep=deep), echo=echo, limit=limit)
+
+
+def sample_objects(fraction=0.01, objs=None, strided=False):
+    """
+      Estimate count and size of gc objects by type from a sample of objects, without running gc.collect(), which is
+      cheap enough to run continuously in production.
+
+      :param float fraction: Fraction of objects to sample, i.e. 0.01 for 1%
+      :param list objs: gc objects to sample. Defaults to gc.get_objects()
+      :param bool strided: Take every Nth object from a random offset instead of a random sample, which is faster
+                           but may be biased if objects are ordered by type.
+      :return: Map of type to dict of estimated 'count' and 'size', and 'count_error' and 'size_error' for the 95%
+               confidence error bounds of each estimate (i.e. count +/- count_error)
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError('Fraction must be greater than 0 and at most 1')
+
+    if objs is None:
+        objs = gc.get_objects()
+
+    total = len(objs)
+    if not total:
+        return {}
+
+    sample_size = min(total, max(1, int(total * fraction)))
+
+    if strided:
+        step = total // sample_size
+        sample = objs[random.randrange(step)::step]
+    else:
+        sample = random.sample(objs, sample_size)
+
+    sample_size = len(sample)
+    counts = Counter(imap(type, sample))
+    sizes = dict.fromkeys(counts, 0)
+    squared_sizes = dict.fromkeys(counts, 0)
+
+    for kind, size in izip(imap(type, sample), imap(sys.getsizeof, sample)):
+        sizes[kind] += size
+        squared_sizes[kind] += size * size
+
+    scale = total / float(sample_size)
+    objs_dict = {}
+
+    for kind, count in counts.items():
+        objs_dict[kind] = {
+            'count': int(round(count * scale)),
+            'size': int(round(sizes[kind] * scale)),
+            'count_error': int(round(_estimate_error(count, count, sample_size, total))),
+            'size_error': int(round(_estimate_error(sizes[kind], squared_sizes[kind], sample_size, total)))
+        }
+
+    return objs_dict
+
+
+def _estimate_error(total, squared_total, sample_size, population_size):
+    """
+      95% confidence error bound of a population total extrapolated from a simple random sample.
+
+      :param total: Sum of values in sample
+      :param squared_total: Sum of squared values in sample
+      :param int sample_size: Number of values in sample, including zeros
+      :param int population_size: Number of values in population
+    """
+    if sample_size < 2:
+        return 0
+
+    variance = max(0, squared_total - total * total / float(sample_size)) / (sample_size - 1)
+    correction = 1 - sample_size / float(population_size)
+
+    return CONFIDENCE_Z * population_size * math.sqrt(correction * variance / sample_size)
+
+
+class IncrementalSummary(object):
+    """
+      Summarize gc objects in slices across calls, so each call pauses the process for at most about `budget` secs::
+
+        summary = IncrementalSummary()
+
+        while not summary.step(budget=0.005):
+            do_other_work()
+
+        summary.summarize()
+
+      References to all objects are held until the summary is done, so objects freed in between are still counted.
+    """
+
+    def __init__(self, objs=None, slice_size=10000):
+        """
+          :param list objs: gc objects to summarize. Defaults to gc.get_objects() (without gc.collect())
+          :param int slice_size: Number of objects to summarize at a time in between checking the time budget.
+        """
+        self.objs = gc.get_objects() if objs is None else objs
+        self.slice_size = slice_size
+        self.position = 0
+
+        #: Map of type to dict of 'count' and 'size' stats of objects summarized so far
+        self.stats = {}
+
+    @property
+    def done(self):
+        return self.objs is None
+
+    def step(self, budget=0.01):
+        """
+          Summarize the next slices of objects until the time budget is used up or all objects are summarized.
+
+          :param float budget: Time budget in seconds. At least one slice is summarized per call.
+          :return: True if all objects are summarized
+        """
+        start_time = time.time()
+
+        while not self.done:
+            objs = self.objs[self.position:self.position + self.slice_size]
+            self.position += len(objs)
+
+            for kind, stats in _summarize_objects(objs).items():
+                if kind in self.stats:
+                    self.stats[kind]['count'] += stats['count']
+                    self.stats[kind]['size'] += stats['size']
+                else:
+                    self.stats[kind] = stats
+
+            if self.position >= len(self.objs):
+                self.objs = None
+
+            elif time.time() - start_time >= budget:
+                break
+
+        return self.done
+
+    def summarize(self, echo=True, limit=10):
+        """ Provide a summary of objects summarized so far, see `summarize_objects` for params. """
+        return _format_summary(self.stats, echo=echo, limit=limit)
+
+
+def _format_summary(objs_dict, echo=True, limit=10):
+    """
+      Format summary from `_summarize_objects`, see `summarize_objects` for params.
+
+      :param dict objs_dict: Map of type to dict of 'count' and 'size' stats, and optionally 'exclusive_size' and
+                             'inclusive_size' stats.
+    """
     size_summary = ['{0:>10s} {1:>5s} {2}'.format('Size', 'Count', 'Type')]
     count_summary = ['{0:>5s} {1:>10s} {2}'.format('Count', 'Size', 'Type')]
+    deep_summary = ['{0:>10s} {1:>10s} {2:>5s} {3}'.format('Inclusive', 'Exclusive', 'Count', 'Type')]
     objs_by_size = []
     objs_by_count = []
+    objs_by_deep_size = []
 
     total_size = total_count = 0
 
@@ -108,42 +518,790 @@ def summarize_objects(objs=None, echo=True, limit=10):
         total_size += stats['size']
         total_count += stats['count']
 
-    for size, count, kind in sorted(objs_by_size, reverse=True):
+        if 'inclusive_size' in stats:
+            objs_by_deep_size.append((stats['inclusive_size'], stats['exclusive_size'], stats['count'], kind))
+
+    for size, count, kind in sorted(objs_by_size, key=_summary_key, reverse=True):
         size_summary.append('{0:>10s} {1:>5s} {2}'.format(fmt(size), fmt(count), kind))
 
-    for count, size, kind in sorted(objs_by_count, reverse=True):
+    for count, size, kind in sorted(objs_by_count, key=_summary_key, reverse=True):
         count_summary.append('{0:>5s} {1:>10s} {2}'.format(fmt(count), fmt(size), kind))
 
+    for inclusive_size, exclusive_size, count, kind in sorted(objs_by_deep_size, key=_summary_key, reverse=True):
+        deep_summary.append('{0:>10s} {1:>10s} {2:>5s} {3}'.format(fmt(inclusive_size), fmt(exclusive_size),
+                                                                   fmt(count), kind))
+
+    summaries = [size_summary, count_summary]
+    if objs_by_deep_size:
+        summaries.append(deep_summary)
+
     if echo:
         print('Objects count', fmt(total_count))
         print('Objects size', fmt(total_size))
         print()
 
-        for summary in [size_summary, count_summary]:
+        for summary in summaries:
             print('\n'.join(summary[:limit + 1]))
             if len(summary) > 10:
                 print('... %d more' % (len(summary) - limit - 1))
             print()
 
     else:
-        return '\n'.join(size_summary + [''] + count_summary)
+        return '\n\n'.join('\n'.join(summary) for summary in summaries)
 
 
-def _summarize_objects(objs):
-    objs_dict = {}
+def take_snapshot(objs=None, track_ids=False, collect=True):
+    """
+      Take a snapshot of gc object stats by type to compare with another snapshot using `diff_snapshots`.
 
-    for obj in objs:
-        _incr(objs_dict, type(obj), 'count')
-        _incr(objs_dict, type(obj), 'size', sys.getsizeof(obj))
+      :param list objs: gc objects to snapshot. Defaults to gc.get_objects()
+      :param bool track_ids: Also keep the id of each object to find objects created between snapshots.
+                             This adds memory proportional to the number of objects.
+      :param bool collect: Run gc.collect() before getting objects when `objs` is not provided, so garbage
+                           does not show up as growth.
+      :return: ObjectsSnapshot of time, stats and ids (None unless `track_ids` is True)
+    """
+    if not objs:
+        if collect:
+            gc.collect()
+        objs = gc.get_objects()
 
-    return objs_dict
+    ids = frozenset(map(id, objs)) if track_ids else None
+
+    return ObjectsSnapshot(time.time(), _summarize_objects(objs), ids)
+
+
+def diff_snapshots(a, b):
+    """
+      Compare two snapshots from `take_snapshot` to find types that grew in between::
+
+        before = take_snapshot(track_ids=True)
+        ...
+        diff = diff_snapshots(before, take_snapshot(track_ids=True))
+
+        for kind, count, size in diff.types[:10]:
+            print(kind, count, size)
+
+        new_objects = get_objects_by_id(diff.new_ids)
+
+      :param ObjectsSnapshot a: Earlier snapshot
+      :param ObjectsSnapshot b: Later snapshot
+      :return: SnapshotDiff of types and new_ids. Types is a list of TypeDelta of kind, count and size deltas for
+               types that changed, ordered by size growth. New ids is a set of ids of objects in `b` but not in `a`,
+               or None if either was taken without `track_ids`.
+    """
+    empty = {'count': 0, 'size': 0}
+    types = []
+
+    for kind in set(a.stats) | set(b.stats):
+        before = a.stats.get(kind, empty)
+        after = b.stats.get(kind, empty)
+        delta = TypeDelta(kind, after['count'] - before['count'], after['size'] - before['size'])
 
+        if delta.count or delta.size:
+            types.append(delta)
 
-def _incr(objs_dict, kind, stat, value=1):
-    if kind not in objs_dict:
-        objs_dict[kind] = {}
+    types.sort(key=lambda d: (d.size, d.count, str(d.kind)), reverse=True)
 
-    if stat not in objs_dict[kind]:
-        objs_dict[kind][stat] = value
+    if a.ids is None or b.ids is None:
+        new_ids = None
     else:
-        objs_dict[kind][stat] += value
+        new_ids = b.ids - a.ids
+
+    return SnapshotDiff(types, new_ids)
+
+
+def get_objects_by_id(ids, objs=None):
+    """
+      Get objects with the given ids, i.e. new_ids from `diff_snapshots`. Note that an id may be reused by a new
+      object once the original object is freed.
+
+      :param set ids: Ids of objects to get
+      :param list objs: gc objects to search. Defaults to gc.get_objects()
+      :return: List of objects
+    """
+    if objs is None:
+        objs = gc.get_objects()
+
+    return [obj for obj in objs if id(obj) in ids]
+
+
+def find_referrer_chains(type_or_predicate, max_depth=10, max_chains=5, samples=20, objs=None, echo=True):
+    """
+      Find out why objects are alive by finding the shortest chains of referrers from module globals or frames to
+      sampled objects, i.e.::
+
+        <module 'myapp.cache'>.__dict__['_CACHE']['user:1'] -> <class 'myapp.models.User'>
+
+      A reverse reference index is built once from gc.get_referents of all objects, so each hop of the breadth first
+      search is a dict lookup instead of a gc.get_referrers scan of all objects.
+
+      :param type|callable type_or_predicate: Type of objects to find chains for, or a function that accepts an object
+                                              and returns True if chains should be found for it.
+      :param int max_depth: Maximum number of references in a chain.
+      :param int max_chains: Maximum number of chains to find.
+      :param int samples: Number of matching objects to randomly sample to search chains from.
+      :param list objs: gc objects to search. Defaults to gc.get_objects()
+      :param bool echo: Print chains to stdout if True, otherwise return chains instead.
+      :return: List of chains as str if echo is False
+    """
+    if objs is None:
+        gc.collect()
+        objs = gc.get_objects()
+
+    if isinstance(type_or_predicate, type):
+        kind = type_or_predicate
+        matches = lambda obj: type(obj) is kind  # noqa
+    else:
+        matches = type_or_predicate
+
+    instances = []
+    for count, obj in enumerate(obj for obj in objs if matches(obj)):
+        if count < samples:
+            instances.append(obj)
+        else:
+            replace = random.randint(0, count)
+            if replace < samples:
+                instances[replace] = obj
+
+    # Frames are only gc objects once they are accessed from Python in newer versions, so add them explicitly
+    objs_ids = set(imap(id, objs))
+    frames = [frame for frame in _thread_frames() if id(frame) not in objs_ids]
+
+    referrers = _referrers_index(objs, frames, set(imap(id, instances)))
+    objs_by_id = dict((id(obj), obj) for obj in objs)
+    objs_by_id.update((id(obj), obj) for obj in frames)
+    objs_by_id.update((id(obj), obj) for obj in instances)
+
+    chains = []
+
+    for instance in instances:
+        if len(chains) >= max_chains:
+            break
+
+        chain = _find_referrer_chain(instance, referrers, objs_by_id, max_depth)
+        if chain:
+            chains.append(_describe_chain(chain))
+
+    if echo:
+        print('Found %d referrer chain%s from %d sampled objects:' % (len(chains), '' if len(chains) == 1 else 's',
+                                                                      len(instances)))
+        for chain in chains:
+            print('  ' + chain)
+
+    else:
+        return chains
+
+
+def _thread_frames():
+    """ Frames of all threads, excluding frames of `find_referrer_chains` as they refer to the objects searched """
+    excluded = (find_referrer_chains.__code__, _thread_frames.__code__)
+    frames = []
+
+    for frame in sys._current_frames().values():
+        while frame is not None:
+            if frame.f_code not in excluded:
+                frames.append(frame)
+            frame = frame.f_back
+
+    return frames
+
+
+def _referrers_index(objs, frames, target_ids):
+    """
+      Build a reverse reference index for `find_referrer_chains`.
+
+      :param list objs: gc objects
+      :param list frames: Frames of all threads that are not in `objs`
+      :param set target_ids: Ids of objects to find chains for, which may not be gc objects.
+      :return: Map of object id to list of ids of gc objects that refer to it. Only references to gc objects and
+               targets are indexed as other objects (i.e. str) can not be part of a chain.
+    """
+    tracked = set(imap(id, objs))
+    tracked.update(imap(id, frames))
+    tracked.update(target_ids)
+
+    # Frames of `find_referrer_chains` refer to the objects being indexed
+    excluded = set([id(sys._getframe()), id(sys._getframe(1))])
+    referrers = {}
+
+    for obj in itertools.chain(objs, frames):
+        if id(obj) in excluded:
+            continue
+
+        referents = gc.get_referents(obj)
+
+        # gc does not traverse locals of frames that are executing
+        if isinstance(obj, types.FrameType):
+            referents.extend(obj.f_locals.values())
+
+        for referent in referents:
+            if id(referent) in tracked:
+                if id(referent) in referrers:
+                    referrers[id(referent)].append(id(obj))
+                else:
+                    referrers[id(referent)] = [id(obj)]
+
+    return referrers
+
+
+def _find_referrer_chain(obj, referrers, objs_by_id, max_depth):
+    """ Breadth first search for the shortest chain of referrers from a module or frame to the object """
+    parents = {id(obj): None}
+    queue = deque([(id(obj), 0)])
+
+    while queue:
+        obj_id, depth = queue.popleft()
+
+        if isinstance(objs_by_id[obj_id], (types.ModuleType, types.FrameType)):
+            chain = []
+            while obj_id is not None:
+                chain.append(objs_by_id[obj_id])
+                obj_id = parents[obj_id]
+            return chain
+
+        if depth >= max_depth:
+            continue
+
+        for referrer_id in referrers.get(obj_id, ()):
+            if referrer_id not in parents:
+                parents[referrer_id] = obj_id
+                queue.append((referrer_id, depth + 1))
+
+
+def _describe_chain(chain):
+    """ Describe chain of objects from a root (module / frame) to the target object, like a Python expression """
+    root = chain[0]
+
+    if isinstance(root, types.ModuleType):
+        parts = ["<module '%s'>" % root.__name__]
+    else:
+        parts = ['<frame %s at %s:%d>' % (root.f_code.co_name, root.f_code.co_filename, root.f_lineno)]
+
+    for parent, child in izip(chain, chain[1:]):
+        parts.append(_describe_reference(parent, child))
+
+    return '%s -> %s' % (''.join(parts), type(chain[-1]))
+
+
+def _describe_reference(parent, child):
+    """ Describe how parent refers to child, i.e. "['key']" or ".attr", or ".<? type>" if unknown """
+    try:
+        if isinstance(parent, dict):
+            for key, value in parent.items():
+                if value is child:
+                    return '[%r]' % (key,)
+                if key is child:
+                    return '.keys()'
+
+        elif isinstance(parent, (list, tuple)):
+            for index, value in enumerate(parent):
+                if value is child:
+                    return '[%d]' % index
+
+        elif isinstance(parent, types.FrameType):
+            if child is parent.f_globals:
+                return '.f_globals'
+            for name, value in parent.f_locals.items():
+                if value is child:
+                    return '.f_locals[%r]' % name
+
+        if getattr(parent, '__dict__', None) is child:
+            return '.__dict__'
+
+        # Classes expose their __dict__ through a mappingproxy that refers to the actual dict
+        if isinstance(parent, type) and any(referent is child for referent in gc.get_referents(parent.__dict__)):
+            return '.__dict__'
+
+        for name, value in getattr(parent, '__dict__', {}).items():
+            if value is child:
+                return '.%s' % name
+
+    except Exception as e:
+        log.debug('Could not describe reference from %s to %s: %s', type(parent), type(child), e)
+
+    return '.<? %s>' % type(child).__name__
+
+
+def start_monitor(interval=60, history=60, cpu_budget=0.05, sample=None):
+    """
+      Start a daemon thread that summarizes gc objects by type periodically, keeping the last N summaries to show
+      growth trends of each type::
+
+        monitor = start_monitor(interval=10, history=30, sample=0.05)
+        ...
+        for kind, count_rate, size_rate in monitor.trends()[:10]:
+            print(kind, count_rate, size_rate)
+
+      :param float interval: Seconds between summaries
+      :param int history: Number of summaries to keep
+      :param float cpu_budget: Maximum fraction of time to spend on summaries. The interval is stretched as needed.
+      :param float sample: Estimate summaries from this fraction of objects using `sample_objects`.
+                           Defaults to summarize all objects (without gc.collect())
+      :return: Started HeapMonitor
+    """
+    monitor = HeapMonitor(interval=interval, history=history, cpu_budget=cpu_budget, sample=sample)
+    monitor.start()
+
+    return monitor
+
+
+class HeapMonitor(threading.Thread):
+    """ Periodically summarize gc objects on a daemon thread. See `start_monitor` """
+
+    def __init__(self, interval=60, history=60, cpu_budget=0.05, sample=None):
+        threading.Thread.__init__(self, name='memorytools-monitor')
+        self.daemon = True
+
+        self.interval = interval
+        self.cpu_budget = cpu_budget
+        self.sample = sample
+
+        #: Last N ObjectsSnapshot (without ids), oldest first
+        self.history = deque(maxlen=history)
+
+        #: Number of cycles skipped as the previous one was still running or to stay within CPU budget
+        self.skipped = 0
+
+        self._stopped = threading.Event()
+        self._running = threading.Lock()
+
+    def run(self):
+        next_time = time.time()
+
+        while not self._stopped.wait(max(0, next_time - time.time())):
+            start_time = time.time()
+            self.take_snapshot()
+            elapsed_time = time.time() - start_time
+
+            next_time += self.interval
+            budget_time = start_time + elapsed_time / self.cpu_budget
+
+            if budget_time > next_time:
+                skipped = int(math.ceil((budget_time - next_time) / self.interval))
+                self.skipped += skipped
+                next_time += skipped * self.interval
+
+    def take_snapshot(self):
+        """
+          Summarize objects and add it to history, unless a summary is already in progress.
+
+          :return: ObjectsSnapshot or None if skipped
+        """
+        if not self._running.acquire(False):
+            self.skipped += 1
+            return
+
+        try:
+            if self.sample:
+                stats = sample_objects(self.sample)
+            else:
+                stats = _summarize_objects(gc.get_objects())
+
+            snapshot = ObjectsSnapshot(time.time(), stats, None)
+            self.history.append(snapshot)
+
+            return snapshot
+
+        finally:
+            self._running.release()
+
+    def trends(self):
+        """
+          Growth rates of each type based on linear regression over the summaries in history.
+
+          :return: List of TypeTrend of kind, count_rate and size_rate (per second), ordered by size growth.
+        """
+        history = list(self.history)
+        if len(history) < 2:
+            return []
+
+        empty = {'count': 0, 'size': 0}
+        times = [snapshot.time for snapshot in history]
+        trends = []
+
+        for kind in set(itertools.chain.from_iterable(snapshot.stats for snapshot in history)):
+            stats = [snapshot.stats.get(kind, empty) for snapshot in history]
+            count_rate = _linear_regression(times, [s['count'] for s in stats])[0]
+            size_rate = _linear_regression(times, [s['size'] for s in stats])[0]
+            trends.append(TypeTrend(kind, count_rate, size_rate))
+
+        trends.sort(key=lambda t: (t.size_rate, t.count_rate, str(t.kind)), reverse=True)
+
+        return trends
+
+    def stop(self, timeout=None):
+        """ Stop the monitor and wait for the current summary to finish """
+        self._stopped.set()
+        self.join(timeout)
+
+
+def start_watchdog(limit=None, rate=None, stat='rss', kind=None, interval=60, window=10, cooldown=600,
+                   hysteresis=0.1, callback=None, log_summary=False, save=False, command=None):
+    """
+      Start a daemon thread that checks memory of this process or count of objects of a type periodically, and runs
+      actions when it grows past a limit or rate, i.e. to save objects at the moment a leak happens::
+
+        start_watchdog(limit=2 * 1024 ** 3, rate=100 * 1024 ** 2 / 3600., save={'binary': True})
+
+      :param float limit: Fire when value is at least this (bytes for stat, or count for kind)
+      :param float rate: Fire when value grows at least this much per second over the last `window` checks
+      :param str stat: Watch 'rss' or 'private' memory of this process
+      :param type kind: Watch count of objects of this type instead of memory, i.e. dict
+      :param float interval: Seconds between checks
+      :param int window: Number of checks to calculate rate from
+      :param float cooldown: Minimum seconds between firing
+      :param float hysteresis: Fraction below limit / rate that value and rate must drop to before firing again
+      :param callable callback: Call with Alert when fired
+      :param bool log_summary: Log summary of gc objects from `summarize_objects` when fired
+      :param bool|dict save: Save gc objects using `save_objects` when fired. Pass a dict to provide keyword args for
+                             `save_objects`, i.e. {'binary': True}
+      :param str command: Run this shell command when fired, with MEMORYTOOLS_ALERT, MEMORYTOOLS_ALERT_VALUE and
+                          MEMORYTOOLS_ALERT_RATE environment variables set from Alert.
+      :return: Started Watchdog
+    """
+    watchdog = Watchdog(limit=limit, rate=rate, stat=stat, kind=kind, interval=interval, window=window,
+                        cooldown=cooldown, hysteresis=hysteresis, callback=callback, log_summary=log_summary,
+                        save=save, command=command)
+    watchdog.start()
+
+    return watchdog
+
+
+class GrowthAlert(object):
+    """
+      Check a value against a limit and / or growth rate. Once fired, it fires again only after the value and rate
+      drop below the thresholds by the hysteresis fraction and the cooldown has passed, so a spike or a steady leak
+      fires once instead of on every check.
+    """
+
+    def __init__(self, name, limit=None, rate=None, window=10, cooldown=600, hysteresis=0.1):
+        """
+          :param str name: Name of the value, i.e. 'rss'
+          :param float limit: Fire when value is at least this
+          :param float rate: Fire when value grows at least this much per second, based on linear regression over the
+                             last `window` checks. Not checked until there are `window` checks.
+          :param int window: Number of checks to calculate rate from
+          :param float cooldown: Minimum seconds between firing
+          :param float hysteresis: Fraction below limit / rate that value and rate must drop to before firing again
+        """
+        if limit is None and rate is None:
+            raise ValueError('Limit or rate is required')
+
+        if window < 2:
+            raise ValueError('Window must be at least 2 to calculate rate')
+
+        self.name = name
+        self.limit = limit
+        self.max_rate = rate
+        self.cooldown = cooldown
+        self.hysteresis = hysteresis
+
+        #: Last N checks of (time, value), oldest first
+        self.history = deque(maxlen=window)
+
+        #: Time when last fired
+        self.last_fired = None
+
+        self._armed = True
+
+    def check(self, value, now=None):
+        """
+          :param float value: Current value
+          :param float now: Time of value. Defaults to current time
+          :return: Alert if fired, otherwise None
+        """
+        now = time.time() if now is None else now
+        self.history.append((now, value))
+        rate = self.rate()
+
+        if not self._armed:
+            if self._exceeded(value, rate, 1 - self.hysteresis):
+                return
+            self._armed = True
+
+        if not self._exceeded(value, rate, 1):
+            return
+
+        if self.last_fired is not None and now - self.last_fired < self.cooldown:
+            return
+
+        self._armed = False
+        self.last_fired = now
+
+        return Alert(self.name, value, rate)
+
+    def rate(self):
+        """ :return: Growth per second over the history, or None if the history is not full yet """
+        if len(self.history) < self.history.maxlen:
+            return
+
+        times, values = zip(*self.history)
+        return _linear_regression(times, values)[0]
+
+    def _exceeded(self, value, rate, factor):
+        if self.limit is not None and value >= self.limit * factor:
+            return True
+
+        return self.max_rate is not None and rate is not None and rate >= self.max_rate * factor
+
+
+class Watchdog(threading.Thread):
+    """ Periodically check memory or count of objects of a type on a daemon thread. See `start_watchdog` """
+
+    def __init__(self, limit=None, rate=None, stat='rss', kind=None, interval=60, window=10, cooldown=600,
+                 hysteresis=0.1, callback=None, log_summary=False, save=False, command=None):
+        threading.Thread.__init__(self, name='memorytools-watchdog')
+        self.daemon = True
+
+        self.stat = stat
+        self.kind = kind
+        self.interval = interval
+        self.callback = callback
+        self.log_summary = log_summary
+        self.save = save
+        self.command = command
+
+        self.alert = GrowthAlert(stat if kind is None else str(kind), limit=limit, rate=rate, window=window,
+                                 cooldown=cooldown, hysteresis=hysteresis)
+
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                log.exception('Failed to check %s', self.alert.name)
+
+            if self._stopped.wait(self.interval):
+                break
+
+    def check(self):
+        """
+          Check current value and run actions if the alert fires.
+
+          :return: Alert if fired, otherwise None
+        """
+        value = self.value()
+
+        if value is None:
+            log.debug('Could not get %s to check', self.alert.name)
+            return
+
+        alert = self.alert.check(value)
+
+        if alert:
+            self.fire(alert)
+
+        return alert
+
+    def value(self):
+        """ :return: Count of objects of kind, or memory stat of this process in bytes (None if not available) """
+        if self.kind is not None:
+            return sum(1 for obj in gc.get_objects() if type(obj) is self.kind)
+
+        from memorytools.show_mem import _get_pid_stats
+
+        stats = _get_pid_stats(os.getpid())
+        return stats.get(self.stat) if stats else None
+
+    def fire(self, alert):
+        """ Run actions for the alert """
+        log.warning('Watchdog fired as %s is %s (rate: %s per second)', alert.name, fmt(alert.value),
+                    'n/a' if alert.rate is None else fmt(alert.rate))
+
+        actions = [
+          (self.callback, lambda: self.callback(alert)),
+          (self.log_summary, lambda: log.info('Objects summary:\n%s', summarize_objects(echo=False))),
+          (self.save, lambda: save_objects(**(self.save if isinstance(self.save, dict) else {}))),
+          (self.command, lambda: _run_alert_command(self.command, alert))]
+
+        for enabled, action in actions:
+            if enabled:
+                try:
+                    action()
+                except Exception:
+                    log.exception('Failed to run action for %s alert', alert.name)
+
+    def stop(self, timeout=None):
+        """ Stop the watchdog and wait for the current check to finish """
+        self._stopped.set()
+        self.join(timeout)
+
+
+def _run_alert_command(command, alert):
+    """
+      Run shell command for an alert with MEMORYTOOLS_ALERT, MEMORYTOOLS_ALERT_VALUE and MEMORYTOOLS_ALERT_RATE
+      environment variables set from the alert (rate is empty if not calculated yet).
+
+      :return: Exit code of command
+    """
+    import subprocess
+
+    env = dict(os.environ, MEMORYTOOLS_ALERT=alert.name, MEMORYTOOLS_ALERT_VALUE=str(alert.value),
+               MEMORYTOOLS_ALERT_RATE='' if alert.rate is None else str(alert.rate))
+
+    return subprocess.call(command, shell=True, env=env)
+
+
+def _linear_regression(xs, ys):
+    """
+      Least squares fit of y = slope * x + intercept
+
+      :return: Tuple of (slope, intercept, standard error of slope)
+    """
+    n = len(xs)
+    mean_x = sum(xs) / float(n)
+    mean_y = sum(ys) / float(n)
+
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in izip(xs, ys))
+
+    if not sxx:
+        return 0.0, mean_y, 0.0
+
+    slope = sxy / sxx
+    intercept = mean_y - slope * mean_x
+
+    if n > 2:
+        residuals = sum((y - intercept - slope * x) ** 2 for x, y in izip(xs, ys))
+        stderr = math.sqrt(residuals / (n - 2) / sxx)
+    else:
+        stderr = 0.0
+
+    return slope, intercept, stderr
+
+
+def _summary_key(stats):
+    """ Sort key for summary stats as types are not orderable in Python 3 """
+    return stats[:-1] + (str(stats[-1]),)
+
+
+def _summarize_objects(objs, deep=False, objs_deep_sizes=None):
+    """
+      Aggregate count and size of objects by type. Types are counted by `Counter` and sizes are summed in a single
+      loop over lazily mapped types / sizes, so no per-object lists are created and the only Python-level work per
+      object is one dict update.
+
+      :param list objs: Objects to summarize
+      :param bool deep: Also aggregate exclusive and inclusive sizes from `deep_sizes`
+      :param dict objs_deep_sizes: Result of `deep_sizes` for objs to aggregate when deep, to avoid walking objs again
+      :return: Map of type to dict of 'count' and 'size' stats, and 'exclusive_size' and 'inclusive_size' if deep.
+    """
+    counts = Counter(imap(type, objs))
+    sizes = dict.fromkeys(counts, 0)
+
+    for kind, size in izip(imap(type, objs), imap(sys.getsizeof, objs)):
+        sizes[kind] += size
+
+    objs_dict = dict((kind, {'count': count, 'size': sizes[kind]}) for kind, count in counts.items())
+
+    if deep:
+        for stats in objs_dict.values():
+            stats['exclusive_size'] = stats['inclusive_size'] = 0
+
+        if objs_deep_sizes is None:
+            objs_sizes = _iter_deep_sizes(objs)
+        else:
+            objs_sizes = (objs_deep_sizes[id(obj)] for obj in objs)
+
+        for kind, (exclusive_size, inclusive_size) in izip(imap(type, objs), objs_sizes):
+            objs_dict[kind]['exclusive_size'] += exclusive_size
+            objs_dict[kind]['inclusive_size'] += inclusive_size
+
+    return objs_dict
+
+
+def deep_sizes(objs=None):
+    """
+      Calculate exclusive and inclusive (deep) sizes of gc objects by walking their referents.
+
+      Each reachable object is attributed to the first object that reaches it, which forms a spanning tree of the
+      object graph that is walked once, so this scales linearly with the number of objects and references. Note that
+      shared objects only count towards the first object that reaches them.
+
+      Classes, modules, functions, code and the globals of modules / functions are shared by the whole interpreter, so
+      they are never reached from other objects, i.e. an instance does not include its class and everything the class
+      reaches. They only count towards themselves when they are in objs.
+
+      * Exclusive size is the size of the object plus referents that are not gc objects (i.e. str, int, etc), such as
+        the keys and values of a dict of strings. Exclusive sizes of all objects add up to the total heap size.
+      * Inclusive size is the size of the object plus everything it reaches, including other gc objects.
+
+      :param list objs: gc objects to calculate sizes for. Defaults to gc.get_objects()
+      :return: Map of object id to tuple of (exclusive size, inclusive size)
+    """
+    if objs is None:
+        gc.collect()
+        objs = gc.get_objects()
+
+    return dict(izip(imap(id, objs), _iter_deep_sizes(objs)))
+
+
+def _iter_deep_sizes(objs):
+    """ Iterate over (exclusive size, inclusive size) of each object, see `deep_sizes` """
+    tracked = set(imap(id, objs))
+    shared = _shared_globals(objs)
+
+    # Position of each visited object in the arrays below, and the objects used by the walk itself, which are excluded
+    positions = {id(objs): -1, id(tracked): -1, id(shared): -1, id(sys._getframe()): -1}
+    parents = array(SIZE_TYPECODE)
+    sizes = array(SIZE_TYPECODE)
+    is_tracked = bytearray()
+    stack = []
+    positions[id(positions)] = positions[id(stack)] = -1
+
+    for root in objs:
+        if id(root) in positions:
+            continue
+
+        positions[id(root)] = len(sizes)
+        parents.append(-1)
+        sizes.append(sys.getsizeof(root))
+        is_tracked.append(1)
+        stack.append(root)
+
+        # Iterative walk as recursion would exceed the stack limit on deep object graphs
+        while stack:
+            obj = stack.pop()
+            position = positions[id(obj)]
+
+            referents = gc.get_referents(obj)
+
+            # Keys of dicts with only str keys are not traversed by gc as they can not form cycles
+            if isinstance(obj, dict):
+                referents.extend(obj)
+
+            for referent in referents:
+                if id(referent) not in positions and id(referent) not in shared and \
+                        not isinstance(referent, SHARED_TYPES):
+                    positions[id(referent)] = len(sizes)
+                    parents.append(position)
+                    sizes.append(sys.getsizeof(referent))
+                    is_tracked.append(id(referent) in tracked)
+                    stack.append(referent)
+
+    # Children are always visited after their parent, so accumulate in reverse to add children before parents
+    exclusive_sizes = array(SIZE_TYPECODE, sizes)
+    inclusive_sizes = array(SIZE_TYPECODE, sizes)
+
+    for position in xrange(len(sizes) - 1, -1, -1):
+        parent = parents[position]
+
+        if parent >= 0:
+            inclusive_sizes[parent] += inclusive_sizes[position]
+            if not is_tracked[position]:
+                exclusive_sizes[parent] += exclusive_sizes[position]
+
+    for obj in objs:
+        position = positions[id(obj)]
+        yield exclusive_sizes[position], inclusive_sizes[position]
+
+
+def _shared_globals(objs):
+    """ :return: Set of ids of globals dicts of loaded modules and of functions in objs, see `SHARED_TYPES` """
+    shared = set(id(vars(module)) for module in list(sys.modules.values()) if module is not None)
+    shared.update(id(obj.__globals__) for obj in objs if isinstance(obj, types.FunctionType))
+
+    return shared
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+"""
+  Run `loop` on multiple hosts: a coordinator hands out runs to agents that connect to it over TCP, and aggregates the
+  stats that agents report back. Messages are JSON objects, one per line::
+
+    $ loop myapp.client:get_user 1 -c 100000 -cc 8 --pipeline --coordinator 0.0.0.0:7000 --agents 3
+    $ loop-agent coordinator-host:7000      # on each of the 3 hosts
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import click
+
+from memorytools.histogram import Histogram
+from memorytools.loop import RunStats, StatsReporter, create_pool, loop_lockstep, loop_pipelined
+
+log = logging.getLogger(__name__)
+
+#: Host to listen on / connect to when only a port is given
+DEFAULT_HOST = '127.0.0.1'
+
+#: Iterations handed out to an agent per pull, per run in flight, so agents with faster runs pull more often
+PULL_SIZE = 10
+
+#: Seconds between stats sent by an agent
+AGENT_STATS_INTERVAL = 1.0
+
+
+@click.command()
+@click.argument('coordinator', metavar='[HOST:]PORT')
+@click.option('--retry', type=float, default=10, show_default=True, metavar='SECS',
+              help='Keep trying to connect to the coordinator for SECS, i.e. when agents are started first.')
+@click.help_option('-h')
+def main(coordinator, retry):
+    """ Pull runs from a `loop --coordinator` and report their stats back to it """
+    if retry < 0:
+        raise click.BadParameter('Retry must be at least 0')
+
+    connection = connect(parse_address(coordinator), retry)
+
+    try:
+        connection.send({'type': 'hello', 'host': socket.gethostname(), 'pid': os.getpid()})
+        work = connection.receive()
+
+        if not work:
+            raise click.ClickException('Coordinator closed the connection before handing out work')
+
+        click.echo('Running {0} for coordinator {1}'.format(work['command_or_code'], coordinator))
+        count = run_agent(connection, work)
+        click.echo('Looped {0} time{1}'.format(count, '' if count == 1 else 's'))
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        connection.close()
+
+
+def parse_address(address):
+    """ :return: Tuple of (host, port) of "[HOST:]PORT" """
+    host, _, port = address.rpartition(':')
+
+    if not port.isdigit():
+        raise click.BadParameter('Address must be [HOST:]PORT, not {0}'.format(address))
+
+    return host or DEFAULT_HOST, int(port)
+
+
+def connect(address, retry=0):
+    """
+      :param tuple address: Tuple of (host, port) of the coordinator
+      :param float retry: Keep trying to connect for this many seconds
+      :return: `Connection` to the coordinator
+    """
+    give_up_time = time.time() + retry
+
+    while True:
+        try:
+            return Connection(socket.create_connection(address))
+
+        except socket.error as e:
+            if time.time() >= give_up_time:
+                raise click.ClickException('Could not connect to coordinator at {0}:{1}: {2}'.format(
+                                           address[0], address[1], e))
+            time.sleep(0.1)
+
+
+class Connection(object):
+    """ Send and receive messages as JSON lines over a socket. Sending is thread-safe. """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._reader = sock.makefile('rb')
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        """ :param dict message: Message with a 'type' """
+        data = (json.dumps(message) + '\n').encode('utf-8')
+
+        with self._lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        """ :return: Next message, or None if the connection is closed """
+        try:
+            line = self._reader.readline()
+            return json.loads(line.decode('utf-8')) if line else None
+
+        except (socket.error, ValueError) as e:
+            log.debug('Could not receive message: %s', e)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass  # Already closed by the other side
+
+        self._reader.close()
+        self.sock.close()
+
+
+def run_coordinator(address, agents, work, max_count, stats_interval=10, json_file=None):
+    """
+      Wait for agents to connect, hand out runs to them until max_count iterations have been handed out (or forever),
+      and show stats of runs reported by agents along with the total at the end.
+
+      :param str address: "[HOST:]PORT" to listen on
+      :param int agents: Number of agents to wait for before starting
+      :param dict work: Arguments for `run_agent`
+      :param int max_count: Number of iterations, which are loops, or runs if pipelined. Defaults to forever.
+      :param float stats_interval: Seconds between showing stats
+      :param str json_file: Append stats to this file as JSON lines, see `StatsReporter`
+    """
+    coordinator = Coordinator(parse_address(address), work, max_count)
+    reporter = None
+
+    click.echo('Waiting for {0} agent{1} on {2}:{3}'.format(agents, '' if agents == 1 else 's', *coordinator.address))
+
+    try:
+        coordinator.accept(agents)
+
+        start_time = time.time()
+        reporter = StatsReporter(stats_interval, json_file)
+        reporter.start()
+
+        coordinator.run(reporter)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        coordinator.stop()
+
+    if not reporter:
+        return
+
+    reporter.stop()
+    count = coordinator.iterations
+    total_time = time.time() - start_time
+
+    click.echo('\nLooped {0} time{1} in {2:.2f} secs across {3} agent{4} with concurrency of {5} each{6}'.format(
+               count, '' if count == 1 else 's', total_time, agents, '' if agents == 1 else 's', work['concurrency'],
+               ' pipelined' if work['pipeline'] else ''))
+    click.echo(reporter.total.format('Total'))
+
+
+class Coordinator(object):
+    """ Hand out runs to agents in batches as they pull them, and add the stats they report to a reporter """
+
+    def __init__(self, address, work, max_count=None):
+        """
+          :param tuple address: Tuple of (host, port) to listen on. Port 0 picks a free port, see `address`
+          :param dict work: Arguments for `run_agent`
+          :param int max_count: Number of iterations to hand out. Defaults to forever.
+        """
+        self.work = work
+        self.remaining = max_count
+        self.reporter = None
+
+        #: Iterations finished by agents
+        self.iterations = 0
+
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self._server.listen(16)
+
+        #: Tuple of (host, port) listened on
+        self.address = self._server.getsockname()
+
+    def accept(self, agents):
+        """ Wait for agents to connect and say hello """
+        while len(self._connections) < agents:
+            sock, address = self._server.accept()
+            connection = Connection(sock)
+            hello = connection.receive()
+
+            if not hello or hello.get('type') != 'hello':
+                log.error('Ignoring connection from %s:%s that is not an agent', *address)
+                connection.close()
+                continue
+
+            click.echo('Agent {0} connected from {1} (PID {2})'.format(len(self._connections) + 1, hello['host'],
+                                                                       hello['pid']))
+            self._connections[connection] = hello
+
+    def run(self, reporter):
+        """
+          Hand out work to each connected agent and serve them until they are done
+
+          :param StatsReporter reporter: Reporter to add stats of agents to
+        """
+        self.reporter = reporter
+        threads = []
+
+        for connection in list(self._connections):
+            thread = threading.Thread(target=self._serve, args=(connection,), name='memorytools-coordinator')
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            # Wait with a timeout, as waiting without one can not be interrupted by CTRL-C in Python 2
+            while thread.is_alive():
+                thread.join(1)
+
+    def pull(self):
+        """ :return: Number of iterations to hand out to an agent, or 0 to stop """
+        batch = PULL_SIZE * self.work['concurrency']
+
+        with self._lock:
+            if self._stopped:
+                return 0
+
+            if self.remaining is None:
+                return batch
+
+            batch = min(batch, self.remaining)
+            self.remaining -= batch
+
+            return batch
+
+    def stop(self):
+        """ Stop handing out runs and disconnect agents """
+        with self._lock:
+            self._stopped = True
+
+        for connection in list(self._connections):
+            connection.close()
+
+        self._server.close()
+
+    def _serve(self, connection):
+        host = self._connections[connection]['host']
+        connection.send(dict(self.work, type='work'))
+
+        while True:
+            message = connection.receive()
+
+            if not message:
+                if not self._stopped:
+                    click.echo('Lost agent on {0}'.format(host))
+                return
+
+            if message['type'] == 'pull':
+                connection.send({'type': 'runs', 'count': self.pull()})
+
+            elif message['type'] == 'stats':
+                stats = RunStats()
+                stats.histogram = Histogram.from_dict(message['histogram'])
+                stats.errors = message['errors']
+
+                self.reporter.add_stats(stats)
+
+                with self._lock:
+                    self.iterations += message['iterations']
+
+            elif message['type'] == 'done':
+                return
+
+
+def run_agent(connection, work):
+    """
+      Pull iterations from the coordinator and loop them until it hands out no more, while sending stats of runs
+
+      :param Connection connection: Connection to the coordinator
+      :param dict work: Dict of command_or_code, delay, concurrency, pipeline, rate, and backend as given to `loop`
+      :return: Number of iterations looped
+    """
+    pool, run = create_pool(work['backend'], work['concurrency'], work['command_or_code'])
+    counter = [0]
+    reporter = AgentReporter(connection, counter)
+    reporter.start()
+
+    try:
+        while True:
+            try:
+                connection.send({'type': 'pull'})
+            except socket.error as e:
+                click.echo('Lost connection to coordinator: {0}'.format(e))
+                break
+
+            message = connection.receive()
+
+            if not message or not message['count']:
+                break
+
+            if counter[0] and not work['pipeline']:
+                time.sleep(work['delay'])
+
+            batch_counter = [0]
+
+            if work['pipeline']:
+                loop_pipelined(pool, work['command_or_code'], work['concurrency'], message['count'], work['rate'],
+                               batch_counter, reporter.add, run=run)
+            else:
+                loop_lockstep(pool, work['command_or_code'], work['delay'], work['concurrency'], message['count'],
+                              batch_counter, reporter.add, run=run)
+
+            counter[0] += batch_counter[0]
+
+    finally:
+        pool.terminate()
+        pool.join()
+        reporter.stop()
+
+    try:
+        connection.send({'type': 'done'})
+    except socket.error as e:
+        log.debug('Could not tell coordinator that agent is done: %s', e)
+
+    return counter[0]
+
+
+class AgentReporter(StatsReporter):
+    """ Send stats of runs in each interval to the coordinator instead of showing them """
+
+    def __init__(self, connection, counter, interval=AGENT_STATS_INTERVAL):
+        """
+          :param Connection connection: Connection to the coordinator
+          :param list counter: Single item list of iterations finished
+          :param float interval: Seconds between sending stats
+        """
+        StatsReporter.__init__(self, interval)
+
+        self.connection = connection
+        self.counter = counter
+        self._sent_iterations = 0
+
+    def report(self, stats, now):
+        iterations = self.counter[0]
+
+        try:
+            self.connection.send({'type': 'stats', 'histogram': stats.histogram.to_dict(), 'errors': stats.errors,
+                                  'iterations': iterations - self._sent_iterations})
+            self._sent_iterations = iterations
+
+        except socket.error as e:
+            log.debug('Could not send stats to coordinator: %s', e)
+
+    def stop(self):
+        """ Stop sending stats periodically and send stats of the last interval """
+        self._stopped.set()
+        self.join()
+
+        with self._lock:
+            stats, self.current = self.current, RunStats()
+
+        self.report(stats, time.time())
@@ -0,0 +1,118 @@
+"""
+  Latency histogram with log-linear buckets, similar to HdrHistogram: values are recorded with a fixed relative
+  precision in constant memory, and histograms from multiple workers / hosts can be merged exactly.
+"""
+
+import math
+
+#: Each power of 2 is split into 2 ** SUB_BUCKET_BITS / 2 buckets, so recorded values are within 1/64 (1.6%)
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKET_BITS = SUB_BUCKET_BITS - 1
+
+#: Smallest value that can be told apart, i.e. 1 microsecond for latencies in seconds
+DEFAULT_UNIT = 1e-6
+
+
+class Histogram(object):
+    """
+      Record values, i.e. latency in seconds, and get percentiles::
+
+        histogram = Histogram()
+        histogram.record(0.0123)
+        histogram.percentile(99)
+    """
+
+    def __init__(self, unit=DEFAULT_UNIT):
+        """ :param float unit: Smallest value that can be told apart. Values are counted in multiples of this. """
+        self.unit = unit
+
+        #: Count of values by bucket index
+        self.counts = {}
+
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """ :param float value: Value to record """
+        index = _bucket_index(int(value / self.unit))
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """ Add values recorded in another histogram with the same unit to this one """
+        if other.unit != self.unit:
+            raise ValueError('Can not merge histograms with different units: %s and %s' % (self.unit, other.unit))
+
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+        self.count += other.count
+        self.total += other.total
+
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """
+          :param float percent: Percentile to get, i.e. 99 for p99
+          :return: Highest value of the bucket containing the percentile (capped by max), or None if empty
+        """
+        if not self.count:
+            return
+
+        target = max(1, int(math.ceil(percent / 100. * self.count)))
+        seen = 0
+
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(_bucket_value(index) * self.unit, self.max)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        """ :return: Dict of the histogram that can be serialized to JSON and loaded with `from_dict` """
+        return {'unit': self.unit, 'counts': dict((str(i), c) for i, c in self.counts.items()), 'count': self.count,
+                'total': self.total, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['unit'])
+        histogram.counts = dict((int(i), c) for i, c in data['counts'].items())
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+
+        return histogram
+
+
+def _bucket_index(units):
+    """ Values below SUB_BUCKETS have their own bucket, and larger values share buckets of increasing width """
+    if units < SUB_BUCKETS:
+        return max(units, 0)
+
+    shift = units.bit_length() - SUB_BUCKET_BITS
+    return (shift << HALF_SUB_BUCKET_BITS) + (units >> shift)
+
+
+def _bucket_value(index):
+    """ :return: Highest value in units of the bucket """
+    if index < SUB_BUCKETS:
+        return index
+
+    shift = (index >> HALF_SUB_BUCKET_BITS) - 1
+    top = index - (shift << HALF_SUB_BUCKET_BITS)
+
+    return ((top + 1) << shift) - 1
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
-from multiprocessing import Pool
+import functools
+import importlib
+import json
 import signal
+import threading
 import time
 
 try:
@@ -11,14 +14,62 @@ except ImportError:
 
 import click
 
+from memorytools import _locale_format
+from memorytools.histogram import Histogram
+
+#: Timer for latency of runs
+_timer = getattr(time, 'perf_counter', time.time)
+
+#: Percentiles of latency to report
+PERCENTILES = [50, 90, 99]
+
+#: Where runs are run, see --backend
+BACKENDS = ['process', 'thread', 'asyncio']
+
+#: Callable for each command_or_code that runs it once, resolved once per worker by `_get_run`
+_runs = {}
+
+#: Minimum memory samples of the watched process before its growth can be significant
+LEAK_MIN_SAMPLES = 10
+
+#: Growth is significant when the slope is this many standard errors above 0 (about 99.7% confidence)
+LEAK_T_STAT = 3.0
+
 
 @click.command()
 @click.argument('command_or_code')
 @click.argument('delay', type=float)
 @click.option('-c', '--count', 'max_count', type=int, help='Number of times to loop. [default: forever]')
 @click.option('-cc', '--concurrency', type=int, default=1, show_default=True, help='Number of concurrent runs per loop.')
+@click.option('-p', '--pipeline', is_flag=True,
+              help='Keep CONCURRENCY runs going by starting a new run as soon as one finishes, instead of looping in '
+                   'lockstep with DELAY between loops. COUNT is the number of runs and DELAY is ignored.')
+@click.option('-r', '--rate', type=float, metavar='RUNS/SEC',
+              help='Start runs at this rate with up to CONCURRENCY runs in flight. Implies --pipeline.')
+@click.option('-i', '--stats-interval', type=float, default=10, show_default=True, metavar='SECS',
+              help='Show latency percentiles, errors and runs per sec of runs in the last SECS while looping.')
+@click.option('--json', 'json_file', metavar='FILE',
+              help='Append stats to FILE as JSON lines every stats interval and at the end.')
+@click.option('-w', '--watch-pid', metavar='PID/NAME',
+              help='Sample rss / private memory of the process being tested and show its growth per iteration, '
+                   'which is a loop, or a run with --pipeline.')
+@click.option('--sample-every', type=int, default=1, show_default=True, metavar='N',
+              help='Sample memory of the watched process every N iterations.')
+@click.option('--stop-on-leak', is_flag=True,
+              help='Stop once memory of the watched process grows significantly over at least {0:d} samples.'.format(
+                   LEAK_MIN_SAMPLES))
+@click.option('-b', '--backend', type=click.Choice(BACKENDS), default='process', show_default=True,
+              help='Run in worker processes, in threads of this process (i.e. to see leaks with summarize_objects), or '
+                   'on an asyncio event loop, where the coroutine returned by module:coro is awaited so CONCURRENCY '
+                   'can be thousands. Code and commands block the event loop.')
+@click.option('--coordinator', metavar='[HOST:]PORT',
+              help='Hand out runs to agents started with `loop-agent HOST:PORT` on other hosts instead of running them, '
+                   'and show stats reported by agents. CONCURRENCY is per agent and RATE is split between agents.')
+@click.option('--agents', type=int, default=1, show_default=True, metavar='N',
+              help='Number of agents to wait for before starting with --coordinator.')
 @click.help_option('-h')
-def main(command_or_code, delay, max_count, concurrency):
+def main(command_or_code, delay, max_count, concurrency, pipeline, rate, stats_interval, json_file, watch_pid,
+         sample_every, stop_on_leak, backend, coordinator, agents):
 
     if concurrency < 1:
         raise click.BadParameter('Concurrency must be greater than 1')
@@ -29,20 +80,49 @@ def main(command_or_code, delay, max_count, concurrency):
     if delay <= 0:
         raise click.BadParameter('Delay must be greater than 0')
 
-    pool = Pool(concurrency, lambda: signal.signal(signal.SIGINT, signal.SIG_IGN))
-    count = 0
+    if rate is not None and rate <= 0:
+        raise click.BadParameter('Rate must be greater than 0')
+
+    if stats_interval <= 0:
+        raise click.BadParameter('Stats interval must be greater than 0')
+
+    if sample_every < 1:
+        raise click.BadParameter('Sample every must be greater than 0')
+
+    if stop_on_leak and not watch_pid:
+        raise click.BadParameter('Stop on leak requires --watch-pid')
+
+    if agents < 1:
+        raise click.BadParameter('Agents must be greater than 0')
+
+    if coordinator and watch_pid:
+        raise click.BadParameter('Watch PID is not supported with --coordinator')
+
+    pipeline = pipeline or rate is not None
+
+    if coordinator:
+        from memorytools.coordinator import run_coordinator
+
+        work = {'command_or_code': command_or_code, 'delay': delay, 'concurrency': concurrency, 'pipeline': pipeline,
+                'rate': rate / agents if rate else None, 'backend': backend}
+        run_coordinator(coordinator, agents, work, max_count, stats_interval, json_file)
+        return
+
+    watcher = MemoryWatcher(_find_watch_pid(watch_pid), sample_every, stop_on_leak) if watch_pid else None
+    pool, run = create_pool(backend, concurrency, command_or_code)
+    counter = [0]
     start_time = time.time()
+    reporter = StatsReporter(stats_interval, json_file)
+    reporter.start()
 
     try:
-        while True:
-            results = pool.map_async(run_command_or_code, [command_or_code] * concurrency)
-            results.wait()
-
-            count += 1
-            if max_count and count >= max_count:
-                break
+        if watcher:
+            watcher.sample(0)
 
-            time.sleep(delay)
+        if pipeline:
+            loop_pipelined(pool, command_or_code, concurrency, max_count, rate, counter, reporter.add, watcher, run)
+        else:
+            loop_lockstep(pool, command_or_code, delay, concurrency, max_count, counter, reporter.add, watcher, run)
 
     except KeyboardInterrupt:
         pass
@@ -50,33 +130,595 @@ def main(command_or_code, delay, max_count, concurrency):
     finally:
         pool.terminate()
         pool.join()
+        reporter.stop()
 
+        count = counter[0]
         total_time = time.time() - start_time
-        click.echo(('\nLooped %d time%s' % (count, 's' if count > 1 else ''))
-                   + (' in %.2f secs' % total_time)
-                   + (' with concurrency of %d (%d runs, %.2f secs per loop, %.2f secs per run)' %
-                      (concurrency, count * concurrency, total_time / count, total_time / count / concurrency) if concurrency > 1 else ''))
+
+        if pipeline:
+            click.echo('\nLooped %d time%s in %.2f secs with concurrency of %d pipelined (%.2f runs per sec)' %
+                       (count, 's' if count > 1 else '', total_time, concurrency, count / total_time))
+        else:
+            click.echo(('\nLooped %d time%s' % (count, 's' if count > 1 else ''))
+                       + (' in %.2f secs' % total_time)
+                       + (' with concurrency of %d (%d runs, %.2f secs per loop, %.2f secs per run)' %
+                          (concurrency, count * concurrency, total_time / count, total_time / count / concurrency) if concurrency > 1 else ''))
+
+        click.echo(reporter.total.format('Total'))
+
+        if watcher:
+            click.echo(watcher.format_growth())
+
+
+def create_pool(backend, concurrency, command_or_code):
+    """
+      :param str backend: One of `BACKENDS`
+      :return: Tuple of (pool, function to run command_or_code in the pool for the loops)
+    """
+    if backend == 'process':
+        from multiprocessing import Pool
+        return Pool(concurrency, init_worker, (command_or_code,)), timed_run
+
+    if backend == 'thread':
+        from multiprocessing.pool import ThreadPool
+        return ThreadPool(concurrency, _preload_run, (command_or_code,)), timed_run
+
+    try:
+        return AsyncioPool(_preload_run, (command_or_code,)), timed_run_async
+    except ImportError:
+        raise click.BadParameter('Asyncio backend requires Python 3')
+
+
+def loop_lockstep(pool, command_or_code, delay, concurrency, max_count, counter, add_result, watcher=None,
+                  run=None):
+    """
+      Run `concurrency` runs at a time and wait for all of them to finish, with delay between loops
+
+      :param list counter: Single item list to increment as loops finish, for the caller to report on interrupt
+      :param callable add_result: Called with result of `timed_run` for each run
+      :param MemoryWatcher watcher: Sample memory of the watched process after each loop, and stop if it says so
+      :param callable run: Function to run in the pool, i.e. `timed_run_async` for `AsyncioPool`
+    """
+    run = run or timed_run
+
+    while True:
+        for result in pool.map_async(run, [command_or_code] * concurrency).get():
+            add_result(result)
+
+        counter[0] += 1
+        if watcher and watcher.sample(counter[0]):
+            break
+
+        if max_count and counter[0] >= max_count:
+            break
+
+        time.sleep(delay)
+
+
+def loop_pipelined(pool, command_or_code, concurrency, max_count, rate, counter, add_result, watcher=None,
+                   run=None):
+    """
+      Keep `concurrency` runs in flight by starting a new run as soon as one finishes, so a slow run does not hold up
+      the others. If rate is given, runs are started at that rate using a token bucket instead of as fast as possible.
+
+      :param list counter: Single item list to increment as runs finish, for the caller to report on interrupt
+      :param callable add_result: Called with result of `timed_run` for each run
+      :param MemoryWatcher watcher: Sample memory of the watched process as runs finish, and stop if it says so
+      :param callable run: Function to run in the pool, i.e. `timed_run_async` for `AsyncioPool`
+    """
+    run = run or timed_run
+    slots = threading.Semaphore(concurrency)
+    bucket = TokenBucket(rate, capacity=concurrency) if rate else None
+    started = 0
+
+    # Runs never raise, so the callback is called for every run. Pool.apply_async has no error callback in Python 2.
+    def finished(result):
+        add_result(result)
+        counter[0] += 1
+        slots.release()
+
+    while not max_count or started < max_count:
+        slots.acquire()
+
+        if watcher and watcher.sample(counter[0]):
+            slots.release()
+            watcher = None
+            break
+
+        if bucket:
+            bucket.take()
+
+        pool.apply_async(run, (command_or_code,), callback=finished)
+        started += 1
+
+    # Wait for runs in flight to finish
+    for _ in range(concurrency):
+        slots.acquire()
+
+    if watcher:
+        watcher.sample(counter[0])
+
+
+class TokenBucket(object):
+    """ Hold an average rate by taking a token for each run, with tokens added at the rate up to capacity """
+
+    def __init__(self, rate, capacity=1):
+        """
+          :param float rate: Tokens added per second
+          :param int capacity: Maximum tokens to accumulate, i.e. to catch up after runs were held up by slow runs.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = 1.0
+        self.last_time = time.time()
+
+    def take(self):
+        """ Take a token, waiting for one to be added if needed """
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+        if self.tokens < 1:
+            time.sleep((1 - self.tokens) / self.rate)
+            self.last_time = time.time()
+            self.tokens = 0.0
+        else:
+            self.tokens -= 1
+
+
+def _find_watch_pid(pid_or_name):
+    """ :return: PID of the process to watch, given its PID or a name that matches exactly one process """
+    if pid_or_name.isdigit():
+        return int(pid_or_name)
+
+    from memorytools.show_mem import _find_pids
+
+    pids = _find_pids(pid_or_name)
+
+    if len(pids) != 1:
+        raise click.BadParameter('{0} processes match "{1}" to watch, instead of 1'.format(len(pids), pid_or_name))
+
+    return pids[0]
+
+
+class MemoryWatcher(object):
+    """
+      Sample memory of a process every N iterations of the loop using the `show_mem` collectors, and fit the growth
+      per iteration with a linear regression, to tell if the process being tested leaks memory and how much.
+    """
+
+    def __init__(self, pid, every=1, stop_on_leak=False):
+        """
+          :param int pid: Process to watch
+          :param int every: Sample every N iterations
+          :param bool stop_on_leak: Tell the loop to stop when growth is significant. See `leaking`
+        """
+        self.pid = pid
+        self.every = every
+        self.stop_on_leak = stop_on_leak
+
+        #: Memory to fit growth of, private if smaps is available, otherwise rss
+        self.stat = None
+        self.iterations = []
+        self.values = []
+
+        self._next_iteration = 0
+
+    def sample(self, iteration):
+        """
+          Sample memory if `every` iterations have passed since the last sample
+
+          :param int iteration: Number of iterations so far
+          :return: True if the loop should stop, as the process is gone or its memory grows significantly
+        """
+        if iteration < self._next_iteration:
+            return False
+
+        self._next_iteration = iteration + self.every
+
+        from memorytools.show_mem import _get_pid_stats, f, MB
+
+        stats = _get_pid_stats(self.pid)
+
+        if not stats:
+            click.echo('Stopping as PID {0} could not be read'.format(self.pid))
+            return True
+
+        if self.stat is None:
+            self.stat = 'private' if 'private' in stats else 'rss'
+
+        self.iterations.append(iteration)
+        self.values.append(stats[self.stat])
+
+        line = 'Iteration {0}: PID {1} (MB): {2:>12s} rss'.format(iteration, self.pid, f(stats['rss'] / float(MB)))
+        if 'private' in stats:
+            line += ' {0:>12s} private'.format(f(stats['private'] / float(MB)))
+
+        if len(self.values) > 1:
+            line += ' ({0} KB per iteration)'.format(f(self.growth()[0] / 1024.))
+
+        click.echo(line)
+
+        if self.stop_on_leak and self.leaking():
+            click.echo('Stopping as {0} of PID {1} grows significantly'.format(self.stat, self.pid))
+            return True
+
+        return False
+
+    def growth(self):
+        """ :return: Tuple of (bytes per iteration, standard error) of memory growth """
+        from memorytools import _linear_regression
+
+        slope, _, stderr = _linear_regression(self.iterations, self.values)
+        return slope, stderr
+
+    def leaking(self):
+        """ :return: True if memory grows with at least `LEAK_T_STAT` confidence over `LEAK_MIN_SAMPLES` samples """
+        if len(self.values) < LEAK_MIN_SAMPLES:
+            return False
+
+        slope, stderr = self.growth()
+        return slope > 0 and slope > LEAK_T_STAT * stderr
+
+    def format_growth(self):
+        """ :return: Growth as a line, i.e. "Memory of PID 123: private grew 12.00 +/- 0.50 KB per iteration ..." """
+        if len(self.values) < 2:
+            return 'Memory of PID {0}: Not enough samples to fit growth'.format(self.pid)
+
+        slope, stderr = self.growth()
+
+        return 'Memory of PID {0}: {1} grew {2} +/- {3} KB per iteration over {4} samples{5}'.format(
+            self.pid, self.stat, _locale_format('%.2f', slope / 1024.), _locale_format('%.2f', stderr / 1024.),
+            len(self.values), ' (significant)' if self.leaking() else '')
+
+
+class RunStats(object):
+    """ Latency histogram, errors and throughput of runs since start time """
+
+    def __init__(self, start_time=None):
+        self.start_time = time.time() if start_time is None else start_time
+        self.histogram = Histogram()
+        self.errors = 0
+
+    @property
+    def runs(self):
+        return self.histogram.count
+
+    def add(self, result):
+        """ :param tuple result: Tuple of (secs, failed) from `timed_run` """
+        secs, failed = result
+        self.histogram.record(secs)
+
+        if failed:
+            self.errors += 1
+
+    def merge(self, other):
+        """ Add runs of other stats, i.e. reported by an agent, to these stats """
+        self.histogram.merge(other.histogram)
+        self.errors += other.errors
+
+    def summary(self, end_time=None):
+        """ :return: Dict of runs, errors, runs_per_sec and latency percentiles / max in secs until end time """
+        elapsed = (time.time() if end_time is None else end_time) - self.start_time
+        latency = dict(('p%d' % p, self.histogram.percentile(p)) for p in PERCENTILES)
+        latency.update(max=self.histogram.max, mean=self.histogram.mean)
+
+        return {'time': self.start_time + elapsed, 'elapsed': elapsed, 'runs': self.runs, 'errors': self.errors,
+                'runs_per_sec': self.runs / elapsed if elapsed > 0 else 0.0, 'latency': latency}
+
+    def format(self, title, end_time=None):
+        """ :return: Summary as a line, i.e. "Total: 10 runs, 0 errors, 5.00 runs per sec, latency (ms) p50 ..." """
+        summary = self.summary(end_time)
+        latency = ''
+
+        if self.runs:
+            latency = ', latency (ms) ' + '  '.join('%s %.2f' % (name, summary['latency'][name] * 1000)
+                                                    for name in ['p%d' % p for p in PERCENTILES] + ['max'])
+
+        return '%s: %d run%s, %d error%s, %.2f runs per sec%s' % (
+            title, self.runs, '' if self.runs == 1 else 's', self.errors, '' if self.errors == 1 else 's',
+            summary['runs_per_sec'], latency)
+
+
+class StatsReporter(threading.Thread):
+    """
+      Collect results of runs from pool callbacks and show stats of the last interval periodically on a daemon thread,
+      along with total stats for the whole loop.
+    """
+
+    def __init__(self, interval=10, json_file=None):
+        """
+          :param float interval: Seconds between showing stats
+          :param str json_file: Append stats to this file as JSON lines every interval and on stop
+        """
+        threading.Thread.__init__(self, name='memorytools-loop-stats')
+        self.daemon = True
+
+        self.interval = interval
+        self.json_file = json_file
+
+        self.total = RunStats()
+        self.current = RunStats(self.total.start_time)
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def add(self, result):
+        """ :param tuple result: Tuple of (secs, failed) from `timed_run` """
+        with self._lock:
+            self.total.add(result)
+            self.current.add(result)
+
+    def add_stats(self, stats):
+        """ :param RunStats stats: Stats of multiple runs, i.e. reported by an agent """
+        with self._lock:
+            self.total.merge(stats)
+            self.current.merge(stats)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                stats, self.current = self.current, RunStats()
+
+            self.report(stats, time.time())
+
+    def report(self, stats, now):
+        """ Show stats of the last interval and append them to JSON file """
+        click.echo(stats.format('%.1fs' % (now - self.total.start_time), end_time=now))
+        self._write_json(stats.summary(now))
+
+    def stop(self):
+        """ Stop showing stats and append total stats to JSON file """
+        self._stopped.set()
+        self.join()
+
+        with self._lock:
+            summary = self.total.summary()
+
+        summary['final'] = True
+        self._write_json(summary)
+
+    def _write_json(self, summary):
+        if self.json_file:
+            with open(self.json_file, 'a') as fp:
+                fp.write(json.dumps(summary, sort_keys=True) + '\n')
+
+
+def timed_run(command_or_code):
+    """ :return: Tuple of (secs, failed) of running `run_command_or_code` """
+    start_time = _timer()
+    succeeded = run_command_or_code(command_or_code)
+
+    if _is_awaitable(succeeded):
+        succeeded.close()
+        click.echo('Coroutine of %s requires --backend asyncio' % command_or_code)
+        succeeded = False
+
+    return _timer() - start_time, not succeeded
+
+
+def timed_run_async(command_or_code):
+    """
+      Start a run on the asyncio event loop of the current thread, where the coroutine returned by a module:coro is
+      awaited by the event loop, and other runs finish before this returns as with `timed_run`.
+
+      :return: Future of tuple of (secs, failed), like `timed_run`
+    """
+    import asyncio
+
+    start_time = _timer()
+    succeeded = run_command_or_code(command_or_code)
+    future = asyncio.get_event_loop().create_future()
+
+    def finished(task):
+        exception = None if task.cancelled() else task.exception()
+
+        if isinstance(exception, SystemExit) and exception.code in (None, 0):
+            exception = None
+        elif isinstance(exception, SystemExit):
+            click.echo('Exited with %s' % exception.code)
+        elif exception is not None:
+            click.echo(str(exception))
+
+        future.set_result((_timer() - start_time, task.cancelled() or exception is not None))
+
+    if _is_awaitable(succeeded):
+        asyncio.ensure_future(succeeded).add_done_callback(finished)
+    else:
+        future.set_result((_timer() - start_time, not succeeded))
+
+    return future
+
+
+def _is_awaitable(result):
+    return hasattr(result, '__await__')
+
+
+class AsyncioPool(object):
+    """
+      Subset of the `multiprocessing.Pool` interface used by the loops that runs functions returning futures, i.e.
+      `timed_run_async`, on an asyncio event loop in a daemon thread. Concurrency is only limited by the loops.
+    """
+
+    def __init__(self, initializer=None, initargs=()):
+        import asyncio
+
+        if initializer:
+            initializer(*initargs)
+
+        self._loop = asyncio.new_event_loop()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run_loop, name='memorytools-loop-asyncio')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run_loop(self):
+        import asyncio
+
+        asyncio.set_event_loop(self._loop)
+
+        while not self._stopped:
+            try:
+                self._loop.run_forever()
+            except SystemExit:
+                pass  # Raised after the task of the run is done with it, which reports the run as failed
+
+    def apply_async(self, func, args=(), callback=None, error_callback=None):
+        """ Call func(*args) on the event loop, and then callback with the result of the returned future """
+        def done(future):
+            if future.cancelled() or future.exception() is not None:
+                if error_callback:
+                    error_callback(future.exception() if not future.cancelled() else Exception('Cancelled'))
+            elif callback:
+                callback(future.result())
+
+        self._loop.call_soon_threadsafe(self._start, func, args, done)
+
+    def map_async(self, func, iterable):
+        """ :return: `_AsyncResult` of list of results from the futures returned by func for each item """
+        import asyncio
+
+        result = _AsyncResult()
+
+        def start():
+            try:
+                asyncio.gather(*[func(item) for item in iterable]).add_done_callback(result.set)
+            except Exception as e:
+                result.set_exception(e)
+
+        self._loop.call_soon_threadsafe(start)
+
+        return result
+
+    def _start(self, func, args, done):
+        try:
+            future = func(*args)
+        except Exception as e:
+            future = self._loop.create_future()
+            future.set_exception(e)
+
+        future.add_done_callback(done)
+
+    def terminate(self):
+        """ Stop the event loop without waiting for runs in flight """
+        self._stopped = True
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def join(self):
+        self._thread.join()
+        self._loop.close()
+
+
+class _AsyncResult(object):
+    """ Result of `AsyncioPool.map_async` to get from another thread, like `multiprocessing.pool.AsyncResult` """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._exception = None
+
+    def set(self, future):
+        if future.cancelled() or future.exception() is not None:
+            self.set_exception(Exception('Cancelled') if future.cancelled() else future.exception())
+        else:
+            self._value = future.result()
+            self._done.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def get(self):
+        self._done.wait()
+
+        if self._exception is not None:
+            raise self._exception
+
+        return self._value
+
+
+def init_worker(command_or_code):
+    """ Pool initializer that ignores CTRL-C, which is handled by the loop, and resolves the run ahead of the first run """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _preload_run(command_or_code)
+
+
+def _preload_run(command_or_code):
+    """ Resolve the run ahead of the first run, i.e. in a pool initializer """
+    try:
+        _get_run(command_or_code)
+    except Exception:
+        pass  # Failed resolution is retried and reported by each run
 
 
 def run_command_or_code(command_or_code):
+    """
+      Run once. The result of a module:method is not returned as it is sent back from the pool, and may not be picklable.
+
+      :return: True if the run succeeded, False if it raised an exception or the command exited with an error, or the
+               awaitable returned by module:coro for the caller to await
+    """
     try:
+        return _get_run(command_or_code)()
+
+    except SystemExit as e:
+        # The pool would wait on the run forever if its worker exited
+        if e.code not in (None, 0):
+            click.echo('Exited with %s' % e.code)
+            return False
+
+        return True
+
+    except BaseException as e:
+        # Runs must not raise as the pool would not call back for them, which leaves their pipeline slot taken
+        click.echo(str(e))
+        return False
+
+
+def _get_run(command_or_code):
+    """
+      Resolve command_or_code to a callable that runs it once and returns True if it succeeded, which is cached so each
+      run is only a function call: the method of a module:method (i.e. package.module:Class.method) is imported once,
+      and code is compiled once.
+    """
+    run = _runs.get(command_or_code)
+
+    if run is None:
         # module:method
         if ':' in command_or_code:
             module_name, method_name = command_or_code.split(':', 1)
 
-            module = __import__(module_name)
-            method = getattr(module, method_name)
+            method = importlib.import_module(module_name)
+            for name in method_name.split('.'):
+                method = getattr(method, name)
 
-            return method()
+            run = functools.partial(_call_method, method)
 
         # code
         elif ' ' in command_or_code:
-
-            exec(command_or_code)
+            run = functools.partial(_exec_code, compile(command_or_code, '<loop>', 'exec'))
 
         # command
         else:
-            subprocess.call(command_or_code, shell=True)
+            run = functools.partial(_call_command, command_or_code)
 
-    except Exception as e:
-        click.echo(str(e))
+        _runs[command_or_code] = run
+
+    return run
+
+
+def _call_method(method):
+    result = method()
+
+    # Coroutines of module:coro are awaited by `timed_run_async`
+    return result if _is_awaitable(result) else True
+
+
+def _exec_code(code):
+    # Names of this module, i.e. time and subprocess, are available to code as they were when it was exec'd in place
+    exec(code, dict(globals()))
+    return True
+
+
+def _call_command(command):
+    return subprocess.call(command, shell=True) == 0
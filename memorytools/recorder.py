@@ -0,0 +1,208 @@
+"""
+  Record memory samples from show-mem to a file and report leak rates from the recording.
+
+  Each sample is a time and a dict of series name to bytes, i.e. {'commit_used': ..., 'pid.123.private': ...}.
+  Recordings are saved based on the file extension:
+
+  * .csv: One row of time, series and bytes per series of each sample
+  * .ring: Fixed size binary ring file that keeps the last N samples of system and total process memory
+  * Anything else: One JSON object per line with time and series of each sample
+"""
+
+import csv
+import json
+import os
+import struct
+
+from memorytools import _linear_regression
+
+RING_MAGIC = b'MEMRING1'
+RING_HEADER = struct.Struct('<8sQQQ')
+RING_SERIES = ['commit_used', 'physical_used', 'rss', 'pss', 'private', 'swap']
+RING_RECORD = struct.Struct('<d%dq' % len(RING_SERIES))
+
+#: Default number of samples to keep in a ring file
+RING_SIZE = 100000
+
+HOUR = 3600
+
+
+def open_recorder(path, ring_size=None):
+    """
+      Open recording file for appending samples, based on extension of the path.
+
+      :param str path: File to record to
+      :param int ring_size: Number of samples to keep in a .ring file. Defaults to RING_SIZE
+      :return: Recorder with record(time, series) and close() methods
+    """
+    if path.endswith('.ring'):
+        return RingRecorder(path, ring_size or RING_SIZE)
+    elif path.endswith('.csv'):
+        return CsvRecorder(path)
+    else:
+        return JsonLinesRecorder(path)
+
+
+def read_samples(path):
+    """
+      Read samples from a recording, oldest first.
+
+      :param str path: Recording file
+      :return: Iterator of (time, series) tuples
+    """
+    if path.endswith('.ring'):
+        return RingRecorder.read(path)
+    elif path.endswith('.csv'):
+        return CsvRecorder.read(path)
+    else:
+        return JsonLinesRecorder.read(path)
+
+
+def leak_rates(samples):
+    """
+      Calculate growth rate of each series using linear regression over the samples.
+
+      :param iterable samples: Samples of (time, series)
+      :return: Tuple of (sample count, duration in secs, list of (series name, bytes per hour, standard error of rate))
+               ordered by series name.
+    """
+    times = {}
+    values = {}
+    count = 0
+    first_time = last_time = None
+
+    for sample_time, series in samples:
+        count += 1
+        first_time = sample_time if first_time is None else min(first_time, sample_time)
+        last_time = sample_time if last_time is None else max(last_time, sample_time)
+
+        for name, value in series.items():
+            times.setdefault(name, []).append(sample_time)
+            values.setdefault(name, []).append(value)
+
+    rates = []
+
+    for name in sorted(times):
+        if len(times[name]) > 1:
+            slope, _, stderr = _linear_regression(times[name], values[name])
+            rates.append((name, slope * HOUR, stderr * HOUR))
+
+    return count, (last_time - first_time) if count else 0, rates
+
+
+class JsonLinesRecorder(object):
+    def __init__(self, path):
+        self.fp = open(path, 'a')
+
+    def record(self, sample_time, series):
+        sample = dict(series)
+        sample['time'] = sample_time
+        self.fp.write(json.dumps(sample, sort_keys=True) + '\n')
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+    @staticmethod
+    def read(path):
+        with open(path) as fp:
+            for line in fp:
+                if line.strip():
+                    series = json.loads(line)
+                    yield series.pop('time'), series
+
+
+class CsvRecorder(object):
+    HEADER = ['time', 'series', 'bytes']
+
+    def __init__(self, path):
+        is_new = not os.path.exists(path) or not os.path.getsize(path)
+
+        self.fp = open(path, 'a')
+        self.writer = csv.writer(self.fp)
+
+        if is_new:
+            self.writer.writerow(self.HEADER)
+
+    def record(self, sample_time, series):
+        for name in sorted(series):
+            self.writer.writerow([repr(sample_time), name, series[name]])
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+    @classmethod
+    def read(cls, path):
+        sample_time = series = None
+
+        with open(path) as fp:
+            for row in csv.reader(fp):
+                if row == cls.HEADER:
+                    continue
+
+                row_time = float(row[0])
+                if row_time != sample_time:
+                    if series:
+                        yield sample_time, series
+                    sample_time, series = row_time, {}
+
+                series[row[1]] = int(row[2])
+
+        if series:
+            yield sample_time, series
+
+
+class RingRecorder(object):
+    """
+      Binary file with a header (magic, capacity, next index, count) followed by `capacity` fixed size records of
+      time and RING_SERIES, so disk usage stays bounded for long recordings. Missing series are saved as -1.
+    """
+
+    def __init__(self, path, capacity=RING_SIZE):
+        if os.path.exists(path) and os.path.getsize(path):
+            self.fp = open(path, 'r+b')
+            self.capacity, self.next_index, self.count = self._read_header(self.fp, path)
+        else:
+            self.fp = open(path, 'w+b')
+            self.capacity, self.next_index, self.count = capacity, 0, 0
+            self._write_header()
+
+    def record(self, sample_time, series):
+        values = [series.get(name, -1) for name in RING_SERIES]
+
+        self.fp.seek(RING_HEADER.size + self.next_index * RING_RECORD.size)
+        self.fp.write(RING_RECORD.pack(sample_time, *values))
+
+        self.next_index = (self.next_index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._write_header()
+
+    def _write_header(self):
+        self.fp.seek(0)
+        self.fp.write(RING_HEADER.pack(RING_MAGIC, self.capacity, self.next_index, self.count))
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+    @staticmethod
+    def _read_header(fp, path):
+        magic, capacity, next_index, count = RING_HEADER.unpack(fp.read(RING_HEADER.size))
+
+        if magic != RING_MAGIC:
+            raise ValueError('%s is not a show-mem ring file' % path)
+
+        return capacity, next_index, count
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as fp:
+            capacity, next_index, count = cls._read_header(fp, path)
+            first_index = next_index if count == capacity else 0
+
+            for i in range(count):
+                fp.seek(RING_HEADER.size + (first_index + i) % capacity * RING_RECORD.size)
+                record = RING_RECORD.unpack(fp.read(RING_RECORD.size))
+
+                yield record[0], dict((name, value) for name, value in zip(RING_SERIES, record[1:]) if value >= 0)
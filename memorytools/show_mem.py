@@ -1,14 +1,20 @@
 #!/usr/bin/env python
 
-import locale
 import logging
 import os
+import re
 import tempfile
+import time
 
 import click
-import psutil
 
-logging.basicConfig(level=logging.ERROR, format='[%(levelname)s] %(message)s')
+from memorytools import _locale_format
+
+try:
+    from itertools import imap
+except ImportError:
+    imap = map
+
 log = logging.getLogger(__name__)
 
 KB = 1024
@@ -17,121 +23,709 @@ KB_NAME = 'kB'
 MB = KB * KB
 MB_NAME = 'MB'
 
+#: Stats to sum from /proc/PID/smaps and pattern of the fields for each. The kernel always reports them in kB.
+SMAPS_FIELDS = [
+  ('rss', re.compile(br'\nRss: +(\d+) kB')),
+  ('private', re.compile(br'\nPrivate_\w+: +(\d+) kB')),
+  ('pss', re.compile(br'\nPss: +(\d+) kB')),
+  ('swap', re.compile(br'\nSwap: +(\d+) kB'))
+]
+SMAPS_CHUNK_SIZE = 1024 * 1024
+
+#: Stat names of smaps fields by field name when summing by mapping. Private_* fields are summed as 'private'.
+SMAPS_MAPPING_FIELDS = {b'Rss:': 'rss', b'Pss:': 'pss', b'Swap:': 'swap'}
+
+#: Number of mappings to show with --maps
+MAPS_LIMIT = 10
+
+#: Mount point of cgroup v2, or of each v1 controller under it, i.e. /sys/fs/cgroup/memory
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+#: Cgroups of this process, i.e. "4:memory:/docker/1234" for v1 or "0::/docker/1234" for v2
+PROC_CGROUP = '/proc/self/cgroup'
+
+#: Cgroup v1 reports no limit as the largest page counter in bytes, so treat anything above this as unlimited
+CGROUP_V1_UNLIMITED = 2 ** 62
+
+#: Number of samples to calculate growth rate from for --alert-rate
+ALERT_WINDOW = 10
+
+#: Maximum number of threads to read stats of processes with
+MAX_THREADS = 16
+
+#: Last used memory by stat name while watching, instead of saving it to a temp file for the next run
+_baselines = None
+
+#: Open files under /proc by path while watching, which are rewound and read again for each sample
+_proc_files = None
+
+#: Paths of files in `_proc_files` read in the current sample, so files of processes that are gone can be closed
+_proc_files_read = None
+
+#: Thread pool to read stats of processes with while watching, which is created on first use and reused for each sample
+_pool = None
+
 
 @click.command()
 @click.option('-p', '--process', metavar='name/id', help='Show memory usage of process with name/id.')
+@click.option('--tree', type=int, metavar='PID',
+              help='Show memory usage of process with PID and its descendants, i.e. a pre-fork server.')
 @click.option('-s', '--system', is_flag=True, help='Show system memory usage with delta. [default]')
+@click.option('-c', '--cgroup', is_flag=True,
+              help='Show memory usage, limit and OOM events of the cgroup (v1 or v2) of show-mem, i.e. the container.')
+@click.option('-a', '--all', 'show_all', is_flag=True,
+              help='Show all processes matching name with a total, instead of 1st & last.')
+@click.option('-t', '--top', type=int, metavar='K',
+              help='Show top K processes matching name by rss with a total, instead of 1st & last.')
+@click.option('-w', '--watch', type=float, metavar='INTERVAL',
+              help='Keep showing memory usage every INTERVAL seconds, with delta from the previous sample.')
+@click.option('-r', '--record', metavar='FILE',
+              help='Append samples to FILE as JSON lines, or CSV / fixed size ring if FILE ends with .csv / .ring')
+@click.option('--ring-size', type=int, metavar='N', help='Keep last N samples in a new .ring FILE. [default: 100,000]')
+@click.option('--report', metavar='FILE', help='Show growth rate of memory in MB/hour from samples recorded in FILE.')
+@click.option('-m', '--maps', is_flag=True,
+              help='Show top mappings of each process by private memory, grouped by file or [heap] / [anon].')
+@click.option('--alert', 'alert_limit', type=float, metavar='MB', help='Alert when memory is at least MB.')
+@click.option('--alert-rate', type=float, metavar='MB/HOUR',
+              help='Alert when memory grows at least MB/HOUR over the last {0:d} samples.'.format(ALERT_WINDOW))
+@click.option('--alert-on', metavar='SERIES',
+              help='Memory to alert on, as named with --record, i.e. private, pid.123.rss, commit_used. '
+                   '[default: rss of processes, cgroup_current, or physical_used]')
+@click.option('--alert-cmd', metavar='CMD',
+              help='Run shell command on alert, with MEMORYTOOLS_ALERT, MEMORYTOOLS_ALERT_VALUE (bytes) and '
+                   'MEMORYTOOLS_ALERT_RATE (bytes/sec) environment variables.')
+@click.option('--alert-cooldown', type=float, default=600, show_default=True, metavar='SECS',
+              help='Minimum seconds between alerts. An alert also waits for memory / rate to drop 10% below the '
+                   'threshold before it fires again.')
 @click.help_option('-h')
-def main(process, system):
-    if system or not(process):
-        show_system_stats()
+def main(process, tree, system, cgroup, show_all, top, watch, record, ring_size, report, maps, alert_limit, alert_rate,
+         alert_on, alert_cmd, alert_cooldown):
+    # Configured here instead of at import as the collectors are also used in-process, i.e. by `Watchdog`
+    logging.basicConfig(level=logging.ERROR, format='[%(levelname)s] %(message)s')
+
+    if top is not None and top < 1:
+        raise click.BadParameter('Top must be greater than 0')
+
+    if watch is not None and watch <= 0:
+        raise click.BadParameter('Watch interval must be greater than 0')
+
+    if ring_size is not None and ring_size < 1:
+        raise click.BadParameter('Ring size must be greater than 0')
+
+    if maps and not (process or tree):
+        raise click.BadParameter('Maps requires a process to show')
+
+    if report:
+        show_recording_report(report)
+        return
+
+    alert = None
+
+    if alert_limit is not None or alert_rate is not None:
+        if watch is None:
+            raise click.BadParameter('Alert requires --watch as it compares samples over time')
+
+        from memorytools import GrowthAlert
+
+        alert_on = alert_on or ('rss' if process or tree else 'cgroup_current' if cgroup else 'physical_used')
+        alert = GrowthAlert(alert_on, limit=None if alert_limit is None else alert_limit * MB,
+                            rate=None if alert_rate is None else alert_rate * MB / 3600., window=ALERT_WINDOW,
+                            cooldown=alert_cooldown)
+
+    elif alert_on or alert_cmd:
+        raise click.BadParameter('Alert or alert rate is required to alert')
+
+    recorder = None
+
+    if record:
+        from memorytools.recorder import open_recorder
+        recorder = open_recorder(record, ring_size=ring_size)
+
+    def show_stats():
+        sample_time = time.time()
+        series = {}
+
+        if system or not (process or tree or cgroup):
+            series.update(show_system_stats())
+
+        if cgroup:
+            series.update(show_cgroup_stats())
+
+        if process:
+            pids_stats = show_process_stats(process, prefer_break=system or cgroup, show_all=show_all, top=top, maps=maps)
+            series.update(_pid_stats_series(pids_stats))
+
+        if tree:
+            pids_stats = show_tree_stats(tree, prefer_break=system or cgroup or process, maps=maps)
+            series.update(_pid_stats_series(pids_stats))
+
+        if recorder:
+            recorder.record(sample_time, series)
+
+        if alert:
+            check_alert(alert, series, sample_time, alert_cmd)
+
+    try:
+        if watch:
+            watch_stats(watch, show_stats)
+        else:
+            show_stats()
 
-    if process:
-        show_process_stats(process, prefer_break=system)
+    finally:
+        if recorder:
+            recorder.close()
+
+
+def check_alert(alert, series, sample_time, command=None):
+    """
+      Check memory of a sample against the alert, and show / run command if it fires.
+
+      :param memorytools.GrowthAlert alert: Alert to check with, named after the series to check
+      :param dict series: Sample of memory by series name, i.e. {'rss': ...}
+      :param float sample_time: Time of sample
+      :param str command: Shell command to run when fired
+    """
+    if alert.name not in series:
+        log.error('Could not find %s memory to alert on', alert.name)
+        return
+
+    fired = alert.check(series[alert.name], now=sample_time)
+
+    if fired:
+        rate = '' if fired.rate is None else ' (rate: {0} MB/hour)'.format(f(fired.rate * 3600 / MB))
+        click.echo('Alert: {0} is {1} MB{2}'.format(fired.name, f(fired.value / float(MB)), rate))
+
+        if command:
+            from memorytools import _run_alert_command
+            _run_alert_command(command, fired)
+
+
+def _pid_stats_series(pids_stats):
+    """
+      Convert stats of processes to series for `memorytools.recorder`, i.e. {'pid.123.rss': ..., 'rss': ...},
+      where series without the PID prefix are totals of all processes.
+
+      :param dict pids_stats: Stats from `_get_pid_stats` by PID
+    """
+    series = {}
+
+    for pid, stats in pids_stats.items():
+        for name, value in stats.items():
+            series['pid.{0:d}.{1}'.format(pid, name)] = value
+
+    series.update(_sum_pid_stats(pids_stats.values()))
+
+    return series
+
+
+def show_recording_report(path):
+    """ Show growth rate of each series recorded by `main` in path, i.e. to find leaks in a long soak test """
+    from memorytools.recorder import leak_rates, read_samples
+
+    count, duration, rates = leak_rates(read_samples(path))
+
+    if count < 2:
+        log.error('Need at least 2 samples in %s to calculate growth rate, but found %d', path, count)
+        return
+
+    click.echo('{0:d} samples over {1} hours in {2}:'.format(count, f(duration / 3600.), path))
+
+    for name, rate, stderr in rates:
+        click.echo('  {0:28}  {1:>10s} +/- {2}'.format('{0} (MB/hour):'.format(name), f(rate / float(MB)),
+                                                       f(stderr / float(MB))))
+
+
+def watch_stats(interval, show_stats):
+    """
+      Call show_stats every interval until interrupted. Baselines for deltas are kept in memory and files under
+      /proc are kept open and re-read, so sampling stays cheap at short intervals. Files not read in a sample, i.e. of
+      processes that are gone, are closed after it.
+
+      :param float interval: Seconds between samples
+      :param callable show_stats: Function that shows stats
+    """
+    global _baselines, _proc_files, _proc_files_read, _pool
+
+    _baselines = {}
+    _proc_files = {}
+    next_time = time.time()
+
+    try:
+        while True:
+            _proc_files_read = set()
+            show_stats()
+            _close_unread_proc_files()
+
+            next_time += interval
+            now = time.time()
+
+            if next_time < now:
+                next_time = now
+            else:
+                time.sleep(next_time - now)
+
+            click.echo()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        for fp in _proc_files.values():
+            fp.close()
+
+        if _pool:
+            _pool.terminate()
+            _pool.join()
+
+        _baselines = _proc_files = _proc_files_read = _pool = None
 
 
 def f(num):
-    return locale.format("%.2f", num, grouping=True)
+    return _locale_format('%.2f', num)
 
 
 def show_system_stats():
-    show_commit_stats()
-    show_physical_stats()
+    """ :return: Dict of 'commit_used' and 'physical_used' memory in bytes for stats shown """
+    series = {}
+
+    commit_used = show_commit_stats()
+    if commit_used is not None:
+        series['commit_used'] = commit_used
 
+    physical_used = show_physical_stats()
+    if physical_used is not None:
+        series['physical_used'] = physical_used
 
-def show_process_stats(name_or_id, prefer_break=False):
+    return series
+
+
+def show_process_stats(name_or_id, prefer_break=False, show_all=False, top=None, maps=False):
     """
       :param str|int name_or_id: Process name or id to filter
       :param bool prefer_break: Add extra newline if needed
+      :param bool show_all: Show all processes matching name with a total, instead of 1st & last.
+      :param int top: Show top K processes matching name by rss with a total, instead of 1st & last.
+      :param bool maps: Show top mappings of each process by private memory
+      :return: Dict of stats from `_get_pid_stats` by PID for processes read
     """
-    pids = []
-    prefer_indent = False
-
     try:
-        pids.append(int(name_or_id))
+        pid = int(name_or_id)
 
     except Exception:
-        all_pids = []
+        pass
 
-        for process in psutil.process_iter():
-            try:
-                if name_or_id.lower() in process.name().lower():
-                    all_pids.append(process.pid)
-            except Exception as e:
-                log.debug('Could not get name of process %s: %s', process, e)
-                continue
+    else:
+        stats = show_pid_stats(pid, prefer_indent=False, maps=maps)
+        return {pid: stats} if stats else {}
 
-        plural = ''
-        first_and_last = ''
+    all_pids = _find_pids(name_or_id)
+    plural = 'es' if len(all_pids) > 1 else ''
+    showing = ''
+    total_stats = read_pids_stats = None
+    pid_maps = {} if maps else None
 
-        if len(all_pids) == 1:
-            pids = all_pids
-        elif len(all_pids) > 1:
-            pids = [all_pids[0], all_pids[-1]]
-            plural = 'es'
-            first_and_last = ' (showing 1st & last)'
-        else:
-            log.error('No process found matching "%s"', name_or_id)
-            return
+    if not all_pids:
+        log.error('No process found matching "%s"', name_or_id)
+        return {}
 
-        prefer_indent = True
-        if prefer_break:
-            click.echo()
+    elif show_all or top:
+        pids_stats = [(pid, stats) for pid, stats in zip(all_pids, _get_all_pid_stats(all_pids, pid_maps)) if stats]
+        total_stats = _sum_pid_stats(stats for _, stats in pids_stats)
+        read_pids_stats = pids_stats
+
+        if top:
+            pids_stats = sorted(pids_stats, key=lambda p: p[1]['rss'], reverse=True)[:top]
+            showing = ' (showing top {0:d} by rss)'.format(len(pids_stats))
+
+    elif len(all_pids) > 1:
+        pids = [all_pids[0], all_pids[-1]]
+        pids_stats = list(zip(pids, _get_all_pid_stats(pids, pid_maps)))
+        showing = ' (showing 1st & last)'
+
+    else:
+        pids_stats = list(zip(all_pids, _get_all_pid_stats(all_pids, pid_maps)))
+
+    if prefer_break:
+        click.echo()
+
+    click.echo('{3:d} process{0} matching "{1}"{2}:'.format(plural, name_or_id, showing, len(all_pids)))
+
+    for pid, stats in pids_stats:
+        if stats:
+            _show_pid_stats(pid, stats, prefer_indent=True)
+
+            if maps and pid in pid_maps:
+                _show_pid_maps(pid_maps[pid], prefer_indent=True)
 
-        click.echo('{3:d} process{0} matching "{1}"{2}:'.format(plural, name_or_id, first_and_last, len(all_pids)))
+    if total_stats:
+        _show_mem_stats(title='  Total', stats=_pid_stats_list(total_stats))
 
-    for pid in pids:
-        show_pid_stats(pid, prefer_indent=prefer_indent)
+    return dict((pid, stats) for pid, stats in (read_pids_stats or pids_stats) if stats)
 
 
-def show_pid_stats(pid, prefer_indent):
+def show_tree_stats(pid, prefer_break=False, maps=False):
+    """
+      Show stats of a process and its descendants, i.e. a pre-fork server master and its workers, with a total of
+      PSS / private memory only as RSS counts pages shared between them once for each process.
+
+      :param int pid: Id of the root process
+      :param bool prefer_break: Add extra newline if needed
+      :param bool maps: Show top mappings of each process by private memory
+      :return: Dict of stats from `_get_pid_stats` by PID for processes read
+    """
+    import psutil
+
     try:
-        process = psutil.Process(pid)
-        mem = process.memory_info()
-    except Exception as e:
-        log.error('Could not get memory info for PID %d: %s', pid, e)
-        return
+        pids = [pid] + [child.pid for child in psutil.Process(pid).children(recursive=True)]
+    except psutil.Error as e:
+        log.error('Could not get process tree of PID %d: %s', pid, e)
+        return {}
+
+    pid_maps = {} if maps else None
+    pids_stats = [(p, stats) for p, stats in zip(pids, _get_all_pid_stats(pids, pid_maps)) if stats]
+
+    if prefer_break:
+        click.echo()
+
+    plural = 'es' if len(pids) > 1 else ''
+    click.echo('{0:d} process{1} in tree of PID {2:d}:'.format(len(pids), plural, pid))
+
+    for p, stats in pids_stats:
+        _show_pid_stats(p, stats, prefer_indent=True)
+
+        if maps and p in pid_maps:
+            _show_pid_maps(pid_maps[p], prefer_indent=True)
+
+    total_stats = _sum_pid_stats(stats for _, stats in pids_stats)
+    total_stats_list = [stat for stat in _pid_stats_list(total_stats) if stat[1] != 'rss'] if total_stats else None
 
-    stats = [(mem.rss, 'rss')]
+    if total_stats_list:
+        _show_mem_stats(title='  Total', stats=total_stats_list)
 
-    private_mem = _get_private_mem(pid)
-    if private_mem:
-        stats.append((private_mem, 'private'))
+    return dict(pids_stats)
 
+
+def _find_pids(name):
+    """
+      Only process names are fetched while iterating, so it stays fast on hosts with thousands of processes.
+
+      :return: List of ids of processes with name containing the given name (case insensitive)
+    """
+    import psutil
+
+    pids = []
+    name = name.lower()
+
+    for process in psutil.process_iter(attrs=['name']):
+        process_name = process.info['name']
+
+        if process_name is None:
+            log.debug('Could not get name of process %s', process.pid)
+
+        elif name in process_name.lower():
+            pids.append(process.pid)
+
+    return pids
+
+
+def show_pid_stats(pid, prefer_indent, maps=False):
+    """
+      :param bool maps: Show top mappings by private memory
+      :return: Stats from `_get_pid_stats`
+    """
+    pid_maps = {}
+    stats = _get_pid_stats(pid, pid_maps) if maps else _get_pid_stats(pid)
+
+    if stats:
+        _show_pid_stats(pid, stats, prefer_indent)
+
+        if maps and pid in pid_maps:
+            _show_pid_maps(pid_maps[pid], prefer_indent)
+
+    return stats
+
+
+def _show_pid_stats(pid, stats, prefer_indent):
     _show_mem_stats(
         title='{0}PID {1:5d}'.format('  ' if prefer_indent else '', pid),
-        stats=stats)
+        stats=_pid_stats_list(stats))
 
 
-def _get_private_mem(pid):
-    total_private = 0
+def _show_pid_maps(maps, prefer_indent):
+    """ :param dict maps: Stats by mapping from `_parse_smaps_mappings` """
+    indent = '    ' if prefer_indent else '  '
+    top_maps = sorted(maps.items(), key=lambda m: (m[1].get('private', 0), m[0]), reverse=True)[:MAPS_LIMIT]
+
+    click.echo('{0}Top {1:d} of {2:d} mappings by private ({3}):'.format(indent, len(top_maps), len(maps), MB_NAME))
+    click.echo('{0}{1:>10s} {2:>10s} {3:>10s} {4:>10s} {5:>6s}  {6}'.format(
+        indent, 'private', 'rss', 'pss', 'swap', 'count', 'mapping'))
+
+    for mapping, stats in top_maps:
+        sizes = [f(stats.get(stat, 0) / float(MB)) for stat in ('private', 'rss', 'pss', 'swap')]
+        click.echo('{0}{1:>10s} {2:>10s} {3:>10s} {4:>10s} {5:>6d}  {6}'.format(indent, *sizes + [stats['count'], mapping]))
+
+
+def _pid_stats_list(stats):
+    """
+      Convert stats from `_get_pid_stats` to list for `_show_mem_stats`. Private is the memory only used by the
+      process (USS), and PSS adds its share of memory shared with other processes, i.e. forked workers.
+    """
+    stats_list = [(stats['rss'], 'rss')]
+
+    if 'pss' in stats:
+        stats_list.append((stats['pss'], 'pss'))
+
+    if stats.get('private'):
+        stats_list.append((stats['private'], 'private'))
+
+    if 'swap' in stats:
+        stats_list.append((stats['swap'], 'swap'))
+
+    return stats_list
+
+
+def _get_pid_stats(pid, pid_maps=None):
+    """
+      :param dict pid_maps: Read full smaps and save stats by mapping from `_parse_smaps_mappings` to this dict by PID
+      :return: Dict of stats from `_get_smaps_stats`, with 'rss' from psutil if smaps could not be read,
+               or None if process could not be read
+    """
+    stats = _get_smaps_stats(pid, pid_maps)
+
+    if 'rss' not in stats:
+        try:
+            import psutil
+            process = psutil.Process(pid)
+            stats['rss'] = process.memory_info().rss
+        except Exception as e:
+            log.error('Could not get memory info for PID %d: %s', pid, e)
+            return
+
+    return stats
 
-    smaps = _get_smaps(pid)
 
-    if smaps:
-        for line in smaps.split('\n'):
-            if line.startswith('Private_'):
-                name, amount, unit = line.split()
+def _get_all_pid_stats(pids, pid_maps=None):
+    """
+      Get stats of multiple processes concurrently, as reading /proc for each process mostly waits on the kernel.
+
+      :param dict pid_maps: Save stats by mapping to this dict by PID. See `_get_pid_stats`
+      :return: List of stats from `_get_pid_stats` in the same order as pids
+    """
+    global _pool
+
+    get_pid_stats = _get_pid_stats if pid_maps is None else lambda pid: _get_pid_stats(pid, pid_maps)
+
+    if len(pids) == 1:
+        return [get_pid_stats(pids[0])]
 
-                if unit == KB_NAME:
-                    total_private += int(amount) * KB
-                elif unit == MB_NAME:
-                    total_private += int(amount) * MB
-                else:
-                    raise Exception('Unsupported memory unit for Private_* memory info from /proc/%d/smaps', pid)
+    from multiprocessing.pool import ThreadPool
 
-    return total_private
+    if _proc_files is not None:
+        if not _pool:
+            _pool = ThreadPool(MAX_THREADS)
 
+        return _pool.map(get_pid_stats, pids)
+
+    pool = ThreadPool(min(len(pids), MAX_THREADS))
 
-def _get_smaps(pid):
     try:
-        with open('/proc/%d/smaps' % pid) as fp:
-            return fp.read()
-    except IOError as e:
-        log.debug('Failed to parse /proc/%d/smaps: %s', pid, e)
+        return pool.map(get_pid_stats, pids)
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _sum_pid_stats(all_stats):
+    """ Sum stats from `_get_pid_stats` of multiple processes """
+    total_stats = {}
+
+    for stats in all_stats:
+        for name, value in stats.items():
+            total_stats[name] = total_stats.get(name, 0) + value
+
+    return total_stats
+
+
+def _get_private_mem(pid):
+    return _get_smaps_stats(pid).get('private', 0)
+
+
+def _get_smaps_stats(pid, pid_maps=None):
+    """
+      :param dict pid_maps: Read full smaps and save stats by mapping from `_parse_smaps_mappings` to this dict by PID
+      :return: Dict of 'rss', 'private' (sum of Private_*), 'pss' and 'swap' memory in bytes from smaps of the process.
+               Empty if smaps could not be read.
+    """
+    smaps = _get_smaps(pid) if pid_maps is None else _get_smaps(pid, rollup=False)
+
+    if not smaps:
+        return {}
+
+    try:
+        if pid_maps is None:
+            return _parse_smaps(smaps)
+
+        stats, pid_maps[pid] = _parse_smaps_mappings(smaps)
+        return stats
+
+    except (IOError, OSError) as e:
+        log.debug('Failed to read smaps of PID %d: %s', pid, e)
+        _close_proc(smaps, discard=True)
+        return {}
+
+    finally:
+        _close_proc(smaps)
+
+
+def _parse_smaps(smaps):
+    """
+      Sum Rss, Private_*, Pss and Swap fields of smaps. Data is read in chunks and scanned as bytes with a regex for each
+      field, so other lines are never split or decoded, and a large smaps is never loaded into memory at once.
+
+      :param file smaps: smaps file opened in binary mode
+      :return: Dict of 'rss', 'private', 'pss' and 'swap' memory in bytes for fields found
+    """
+    stats = {}
+    remainder = b'\n'
+
+    while True:
+        chunk = smaps.read(SMAPS_CHUNK_SIZE)
+        data = remainder + chunk
+
+        # Fields are matched from the newline before them, so keep the last newline with the incomplete last line
+        end = data.rfind(b'\n') if chunk else len(data)
+
+        for stat, pattern in SMAPS_FIELDS:
+            amounts = pattern.findall(data, 0, end)
+            if amounts:
+                stats[stat] = stats.get(stat, 0) + sum(imap(int, amounts)) * KB
+
+        if not chunk:
+            return stats
+
+        remainder = data[end:]
+
+
+def _parse_smaps_mappings(smaps):
+    """
+      Sum Rss, Private_*, Pss and Swap fields of smaps by mapping, i.e. backing file, [heap] or [anon] for anonymous
+      mappings, along with the total of all mappings in the same pass.
+
+      :param file smaps: Full smaps file (not smaps_rollup) opened in binary mode
+      :return: Tuple of (dict of total stats like `_parse_smaps`, dict of stats by mapping with 'count' of mappings)
+    """
+    maps = {}
+    stats = None
+
+    for line in _iter_lines(smaps):
+        if line[:1].isupper():
+            if stats is None:
+                continue
+
+            fields = line.split()
+            stat = 'private' if fields[0].startswith(b'Private_') else SMAPS_MAPPING_FIELDS.get(fields[0])
+
+            if stat:
+                stats[stat] = stats.get(stat, 0) + int(fields[1]) * KB
+
+        else:
+            # Mapping header, i.e. "7f2c4e600000-7f2c4e800000 rw-p 00000000 00:00 0    [heap]"
+            fields = line.split(None, 5)
+            if len(fields) < 5:
+                continue
+
+            mapping = fields[5].strip().decode('utf-8', 'replace') if len(fields) > 5 else '[anon]'
+            stats = maps.setdefault(mapping, {'count': 0})
+            stats['count'] += 1
+
+    total_stats = _sum_pid_stats(stats for stats in maps.values())
+    total_stats.pop('count', None)
+
+    return total_stats, maps
+
+
+def _iter_lines(fp):
+    """
+      Iterate over lines of a binary file without line endings. Data is read in chunks as files under /proc are opened
+      unbuffered by `_open_proc`, where iterating over the file itself would read a byte at a time.
+    """
+    remainder = b''
+
+    while True:
+        chunk = fp.read(SMAPS_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+
+        for line in lines:
+            yield line
+
+    if remainder:
+        yield remainder
+
+
+def _get_smaps(pid, rollup=True):
+    """
+      Open /proc/PID/smaps_rollup if the kernel provides it as it is much smaller, otherwise /proc/PID/smaps
+
+      :param bool rollup: Try smaps_rollup first. Set to False to always read smaps, i.e. for stats by mapping.
+    """
+    smaps_files = ['/proc/%d/smaps' % pid]
+    if rollup:
+        smaps_files.insert(0, '/proc/%d/smaps_rollup' % pid)
+
+    for smaps_file in smaps_files:
+        try:
+            return _open_proc(smaps_file)
+        except IOError as e:
+            log.debug('Failed to open %s: %s', smaps_file, e)
+
+
+def _open_proc(path):
+    """
+      Open file under /proc (or /sys) in binary mode. While watching, files are kept open and rewound for the next read.
+    """
+    if _proc_files is None:
+        return open(path, 'rb', 0)
+
+    fp = _proc_files.get(path)
+
+    if fp:
+        fp.seek(0)
+    else:
+        fp = _proc_files[path] = open(path, 'rb', 0)
+
+    _proc_files_read.add(path)
+
+    return fp
+
+
+def _close_proc(fp, discard=False):
+    """
+      Close file from `_open_proc`, unless it is kept open while watching.
+
+      :param bool discard: Close file even if it is kept open, i.e. when the process is gone.
+    """
+    if _proc_files is None or _proc_files.get(fp.name) is not fp:
+        fp.close()
+
+    elif discard:
+        del _proc_files[fp.name]
+        fp.close()
+
+
+def _close_unread_proc_files():
+    """ Close files kept open while watching that were not read in the last sample, i.e. of processes that are gone """
+    for path in list(_proc_files):
+        if path not in _proc_files_read:
+            _proc_files.pop(path).close()
 
 
 def show_commit_stats():
+    """ :return: Used commit memory in bytes, or None if it could not be read """
     mem_info = _get_meminfo()
 
     if not mem_info:
@@ -166,8 +760,27 @@ def show_commit_stats():
 
     _show_mem_stats_with_delta("Commit Mem", total_commit, total_used)
 
+    return total_used
+
 
 def show_physical_stats():
+    """
+      Physical memory is read from /proc/meminfo when available, so psutil is only imported on other platforms.
+
+      :return: Used physical memory in bytes, excluding buffers / cache
+    """
+    mem_info = _parse_meminfo(_get_meminfo())
+
+    if 'MemTotal' in mem_info:
+        total = mem_info['MemTotal']
+        used = total - sum(mem_info.get(field, 0) for field in ('MemFree', 'Buffers', 'Cached'))
+
+        _show_mem_stats_with_delta('Physical Mem', total, used)
+
+        return used
+
+    import psutil
+
     vm_stats = psutil.virtual_memory()
 
     used = vm_stats.used
@@ -180,6 +793,138 @@ def show_physical_stats():
 
     _show_mem_stats_with_delta('Physical Mem', vm_stats.total, used)
 
+    return used
+
+
+def show_cgroup_stats():
+    """
+      Show memory of the cgroup of this process, which triggers OOM kills in a container instead of host memory.
+      The limit is the host's total memory if the cgroup has none.
+
+      :return: Dict of 'cgroup_used', 'cgroup_anon', 'cgroup_file' memory in bytes and 'cgroup_oom' / 'cgroup_oom_kill'
+               event counts for stats shown
+    """
+    stats = _get_cgroup_stats()
+
+    if not stats:
+        log.error('Could not find memory cgroup of this process')
+        return {}
+
+    limit = stats['max'] or _parse_meminfo(_get_meminfo()).get('MemTotal', 0)
+
+    _show_mem_stats_with_delta('Cgroup Mem', limit, stats['current'])
+    _show_mem_stats('Cgroup Usage', [(stats.get('anon', 0), 'anon'), (stats.get('file', 0), 'file')])
+
+    formatted_events = ['{0:20}'.format('Cgroup Events:')]
+
+    for event in ('oom', 'oom_kill'):
+        if event in stats:
+            last_count = _last_used_mem('Cgroup ' + event, current_used=stats[event])
+            delta = ' (delta: {0:d})'.format(stats[event] - last_count) if last_count is not None else ''
+            formatted_events.append('{0:>10d} {1}{2}'.format(stats[event], event, delta))
+
+    if len(formatted_events) > 1:
+        click.echo('  '.join(formatted_events))
+
+    return dict(('cgroup_' + name, stats[name]) for name in ('current', 'anon', 'file', 'oom', 'oom_kill')
+                if name in stats)
+
+
+def _get_cgroup_stats():
+    """
+      Read memory stats of the cgroup of this process directly from its files, which are kept open while watching.
+
+      :return: Dict of 'version', 'current' and 'max' (None if unlimited) memory, 'anon' / 'file' memory from
+               memory.stat, and 'oom' / 'oom_kill' event counts if the kernel reports them, or None if the memory cgroup
+               could not be found.
+    """
+    cgroup = _find_cgroup()
+
+    if not cgroup:
+        return
+
+    version, path = cgroup
+
+    try:
+        if version == 2:
+            memory_max = _read_cgroup_file(path, 'memory.max').strip()
+            memory_stat = _parse_cgroup_keys(_read_cgroup_file(path, 'memory.stat'))
+            stats = _parse_cgroup_keys(_read_cgroup_file(path, 'memory.events'))
+            stats.update({
+              'current': int(_read_cgroup_file(path, 'memory.current')),
+              'max': None if memory_max == 'max' else int(memory_max),
+              'anon': memory_stat.get('anon', 0),
+              'file': memory_stat.get('file', 0)})
+
+        else:
+            memory_max = int(_read_cgroup_file(path, 'memory.limit_in_bytes'))
+            memory_stat = _parse_cgroup_keys(_read_cgroup_file(path, 'memory.stat'))
+            oom_control = _parse_cgroup_keys(_read_cgroup_file(path, 'memory.oom_control'))
+            stats = {
+              'current': int(_read_cgroup_file(path, 'memory.usage_in_bytes')),
+              'max': None if memory_max >= CGROUP_V1_UNLIMITED else memory_max,
+              'anon': memory_stat.get('total_rss', memory_stat.get('rss', 0)),
+              'file': memory_stat.get('total_cache', memory_stat.get('cache', 0))}
+
+            if 'oom_kill' in oom_control:
+                stats['oom_kill'] = oom_control['oom_kill']
+
+    except (IOError, OSError, ValueError) as e:
+        log.debug('Failed to read memory cgroup %s: %s', path, e)
+        return
+
+    stats['version'] = version
+
+    return stats
+
+
+def _find_cgroup():
+    """ :return: Tuple of (version, directory) of the memory cgroup of this process, or None if not found """
+    try:
+        cgroups = _read_cgroup_file(PROC_CGROUP)
+    except (IOError, OSError) as e:
+        log.debug('Failed to read %s: %s', PROC_CGROUP, e)
+        return
+
+    candidates = []
+
+    for line in cgroups.splitlines():
+        hierarchy, controllers, path = line.split(':', 2)
+
+        if 'memory' in controllers.split(','):
+            candidates.insert(0, (1, os.path.join(CGROUP_ROOT, 'memory'), path, 'memory.usage_in_bytes'))
+
+        elif hierarchy == '0':
+            candidates.append((2, CGROUP_ROOT, path, 'memory.current'))
+
+    # Inside a container, the cgroup of the container is usually mounted as the root, so try that if path is not found
+    for version, root, path, memory_file in candidates:
+        for cgroup_dir in (os.path.join(root, path.lstrip('/')), root):
+            if os.path.exists(os.path.join(cgroup_dir, memory_file)):
+                return version, cgroup_dir
+
+
+def _read_cgroup_file(*paths):
+    fp = _open_proc(os.path.join(*paths))
+
+    try:
+        return fp.read().decode()
+    finally:
+        _close_proc(fp)
+
+
+def _parse_cgroup_keys(content):
+    """ :return: Dict of int value by key from flat keyed cgroup file, i.e. memory.stat with lines of "anon 1234" """
+    keys = {}
+
+    for line in content.splitlines():
+        parts = line.split()
+
+        if len(parts) == 2 and parts[1].isdigit():
+            keys[parts[0]] = int(parts[1])
+
+    return keys
+
 
 def _show_mem_stats_with_delta(title, total, used):
     last_used = _last_used_mem(title, current_used=used)
@@ -208,6 +953,11 @@ def _show_mem_stats(title, stats):
 
 
 def _last_used_mem(name, current_used):
+    if _baselines is not None:
+        last_used = _baselines.get(name)
+        _baselines[name] = current_used
+        return last_used
+
     used_mem_file = os.path.join(tempfile.gettempdir(), 'show-mem-' + name.replace(' ', '_'))
 
     try:
@@ -229,9 +979,27 @@ def _last_used_mem(name, current_used):
     return last_used
 
 
+def _parse_meminfo(mem_info):
+    """ :return: Dict of memory in bytes by field name from content of /proc/meminfo, i.e. {'MemTotal': ...} """
+    fields = {}
+
+    for line in (mem_info or '').split('\n'):
+        parts = line.split()
+
+        if len(parts) == 3 and parts[2] in (KB_NAME, MB_NAME):
+            fields[parts[0].rstrip(':')] = int(parts[1]) * (KB if parts[2] == KB_NAME else MB)
+
+    return fields
+
+
 def _get_meminfo():
     try:
-        with open('/proc/meminfo') as fp:
-            return fp.read()
+        fp = _open_proc('/proc/meminfo')
     except IOError as e:
         log.debug('Skipping commit memory:%s', e)
+        return
+
+    try:
+        return fp.read().decode()
+    finally:
+        _close_proc(fp)
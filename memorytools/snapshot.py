@@ -0,0 +1,252 @@
+"""
+  Compact binary snapshot of gc objects, written by `save_objects(binary=True)` / `write_snapshot` and read with
+  `Snapshot`, which memory maps the file so large snapshots can be filtered and summarized from another process.
+
+  File layout (all integers are little-endian)::
+
+    Header      magic, version, flags, record count, referent count, type table offset
+    Records     Fixed-width records of id, size, type index, referent count, referent start
+    Referents   Ids of referents (only if saved with referents), indexed by referent start / count of each record
+    Type table  Count of types followed by length prefixed UTF-8 type names, indexed by type index
+"""
+
+from collections import namedtuple
+import gc
+import mmap
+import shutil
+import struct
+import sys
+import tempfile
+
+MAGIC = b'MEMTOOLS'
+VERSION = 1
+
+FLAG_REFERENTS = 1
+
+HEADER = struct.Struct('<8sIIQQQ')
+RECORD = struct.Struct('<QQIIQ')
+REFERENT = struct.Struct('<Q')
+TYPE_COUNT = struct.Struct('<I')
+TYPE_NAME_LEN = struct.Struct('<H')
+
+#: Number of records to pack before writing them to file
+CHUNK_SIZE = 10000
+
+Record = namedtuple('Record', ['index', 'id', 'size', 'type', 'referent_count', 'referent_start'])
+
+
+def write_snapshot(path, objs, referents=False):
+    """
+      Write a binary snapshot of objects to file.
+
+      :param str path: File to write to
+      :param list objs: Objects to save
+      :param bool referents: Save ids of referents (from gc.get_referents) for each object
+      :return: Total size of objects
+    """
+    types = {}
+    total_size = 0
+    referent_count = 0
+
+    with open(path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0, 0))
+
+        referents_fp = tempfile.TemporaryFile() if referents else None
+
+        try:
+            chunk = []
+            referents_chunk = []
+
+            for obj in objs:
+                kind = str(type(obj))
+                if kind not in types:
+                    types[kind] = len(types)
+
+                size = sys.getsizeof(obj)
+                total_size += size
+
+                if referents:
+                    ids = [id(r) for r in gc.get_referents(obj)]
+                    chunk.append(RECORD.pack(id(obj), size, types[kind], len(ids), referent_count))
+                    referents_chunk.append(struct.pack('<%dQ' % len(ids), *ids))
+                    referent_count += len(ids)
+
+                else:
+                    chunk.append(RECORD.pack(id(obj), size, types[kind], 0, 0))
+
+                if len(chunk) >= CHUNK_SIZE:
+                    fp.write(b''.join(chunk))
+                    chunk = []
+
+                    if referents:
+                        referents_fp.write(b''.join(referents_chunk))
+                        referents_chunk = []
+
+            fp.write(b''.join(chunk))
+
+            if referents:
+                referents_fp.write(b''.join(referents_chunk))
+                referents_fp.seek(0)
+                shutil.copyfileobj(referents_fp, fp)
+
+        finally:
+            if referents_fp:
+                referents_fp.close()
+
+        types_offset = fp.tell()
+        fp.write(TYPE_COUNT.pack(len(types)))
+        for kind, _ in sorted(types.items(), key=lambda t: t[1]):
+            name = kind.encode('utf-8')
+            fp.write(TYPE_NAME_LEN.pack(len(name)) + name)
+
+        fp.seek(0)
+        fp.write(HEADER.pack(MAGIC, VERSION, FLAG_REFERENTS if referents else 0, len(objs), referent_count,
+                             types_offset))
+
+    return total_size
+
+
+class Snapshot(object):
+    """
+      Read a binary snapshot written by `write_snapshot`. The file is memory mapped and records are only unpacked
+      when accessed, so multi-GB snapshots can be summarized without loading them into memory::
+
+        with Snapshot('/var/tmp/objects-12345.snapshot') as snapshot:
+            snapshot.summarize()
+
+            for record in snapshot.filter(kind=dict, min_size=1024 * 1024):
+                print(record.id, record.size, snapshot.referents(record))
+    """
+
+    def __init__(self, path):
+        """ :param str path: Snapshot file to read """
+        self.path = path
+        self._fp = open(path, 'rb')
+
+        try:
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._fp.close()
+            raise
+
+        magic, version, self.flags, self.count, self.referent_count, types_offset = HEADER.unpack_from(self._map, 0)
+
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a memory-tools snapshot' % path)
+
+        if version != VERSION:
+            self.close()
+            raise ValueError('Unsupported snapshot version %d in %s' % (version, path))
+
+        self._records_offset = HEADER.size
+        self._referents_offset = self._records_offset + self.count * RECORD.size
+
+        #: List of type names, indexed by type index of records
+        self.types = []
+
+        offset = types_offset + TYPE_COUNT.size
+        for _ in range(TYPE_COUNT.unpack_from(self._map, types_offset)[0]):
+            name_len = TYPE_NAME_LEN.unpack_from(self._map, offset)[0]
+            offset += TYPE_NAME_LEN.size
+            self.types.append(self._map[offset:offset + name_len].decode('utf-8'))
+            offset += name_len
+
+    @property
+    def has_referents(self):
+        return bool(self.flags & FLAG_REFERENTS)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+
+        if not 0 <= index < self.count:
+            raise IndexError('Record index out of range')
+
+        return self._record(index, RECORD.unpack_from(self._map, self._records_offset + index * RECORD.size))
+
+    def __iter__(self):
+        for index, fields in enumerate(self._iter_fields()):
+            yield self._record(index, fields)
+
+    def _record(self, index, fields):
+        obj_id, size, type_index, referent_count, referent_start = fields
+        return Record(index, obj_id, size, self.types[type_index], referent_count, referent_start)
+
+    def _iter_fields(self):
+        """ Iterate over raw record fields without creating `Record` """
+        if hasattr(RECORD, 'iter_unpack'):
+            records = memoryview(self._map)[self._records_offset:self._referents_offset]
+            try:
+                for fields in RECORD.iter_unpack(records):
+                    yield fields
+            finally:
+                records.release()
+
+        else:
+            for offset in range(self._records_offset, self._referents_offset, RECORD.size):
+                yield RECORD.unpack_from(self._map, offset)
+
+    def referents(self, record):
+        """
+          :param Record record: Record to get referents for
+          :return: Tuple of ids of referents of the record. Empty if snapshot was written without referents.
+        """
+        if not record.referent_count:
+            return ()
+
+        offset = self._referents_offset + record.referent_start * REFERENT.size
+        return struct.unpack_from('<%dQ' % record.referent_count, self._map, offset)
+
+    def filter(self, kind=None, min_size=0):
+        """
+          Iterate over records matching the given criteria.
+
+          :param type|str kind: Only include objects of this type or type name, i.e. dict or "<class 'dict'>"
+          :param int min_size: Only include objects of at least this size in bytes.
+        """
+        type_index = None
+
+        if kind is not None:
+            kind = kind if isinstance(kind, str) else str(kind)
+            if kind not in self.types:
+                return
+            type_index = self.types.index(kind)
+
+        for index, fields in enumerate(self._iter_fields()):
+            if fields[1] >= min_size and (type_index is None or fields[2] == type_index):
+                yield self._record(index, fields)
+
+    def summarize(self, echo=True, limit=10):
+        """
+          Provide a summary of objects in the snapshot based on type, same as `summarize_objects`.
+
+          :param bool echo: Print summary results to stdout if True, otherwise return results instead.
+          :param int limit: Limit number of results in each summary. Defaults to show top 10.
+          :return: Summary results if echo is False
+        """
+        from memorytools import _format_summary
+
+        counts = [0] * len(self.types)
+        sizes = [0] * len(self.types)
+
+        for _, size, type_index, _, _ in self._iter_fields():
+            counts[type_index] += 1
+            sizes[type_index] += size
+
+        objs_dict = dict((kind, {'count': counts[i], 'size': sizes[i]}) for i, kind in enumerate(self.types))
+
+        return _format_summary(objs_dict, echo=echo, limit=limit)
+
+    def close(self):
+        self._map.close()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
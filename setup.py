@@ -19,6 +19,7 @@ setuptools.setup(
     'console_scripts': [
       'show-mem = memorytools.show_mem:main',
       'loop = memorytools.loop:main',
+      'loop-agent = memorytools.coordinator:main',
     ],
   },
 
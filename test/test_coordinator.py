@@ -0,0 +1,67 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+
+from memorytools.coordinator import Coordinator, parse_address
+from memorytools.loop import main
+
+from utils import temp_directory
+
+AGENT = 'from memorytools.coordinator import main; main()'
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+
+def test_coordinator(runner):
+    address = '127.0.0.1:%d' % free_port()
+    agents = [subprocess.Popen([sys.executable, '-c', AGENT, address], stdout=subprocess.PIPE,
+                               universal_newlines=True) for _ in range(2)]
+
+    try:
+        with temp_directory() as temp_dir:
+            json_file = os.path.join(temp_dir, 'stats.jsonl')
+            result = runner.invoke(main, ['import time; time.sleep(0.01)', '1', '-c', 100, '-cc', 2, '-p',
+                                          '--coordinator', address, '--agents', 2, '--json', json_file])
+
+            assert result.exit_code == 0
+            assert 'Waiting for 2 agents on %s' % address in result.output
+            assert 'Looped 100 times in ' in result.output
+            assert ' across 2 agents with concurrency of 2 each pipelined' in result.output
+            assert 'Total: 100 runs, 0 errors, ' in result.output
+
+            with open(json_file) as fp:
+                stats = json.loads(fp.read().splitlines()[-1])
+
+            assert (stats['runs'], stats['errors']) == (100, 0)
+
+        outputs = [agent.communicate()[0] for agent in agents]
+
+        assert [agent.returncode for agent in agents] == [0, 0]
+        assert sum(int(output.split('Looped ')[1].split()[0]) for output in outputs) == 100
+
+    finally:
+        for agent in agents:
+            if agent.poll() is None:
+                agent.kill()
+
+
+def test_coordinator_pull():
+    coordinator = Coordinator(('127.0.0.1', 0), {'concurrency': 2}, max_count=25)
+
+    try:
+        assert coordinator.address[1]
+        assert [coordinator.pull() for _ in range(3)] == [20, 5, 0]
+    finally:
+        coordinator.stop()
+
+    assert parse_address('7000') == ('127.0.0.1', 7000)
+    assert parse_address('0.0.0.0:7000') == ('0.0.0.0', 7000)
@@ -0,0 +1,34 @@
+import json
+
+from memorytools.histogram import Histogram
+
+
+def test_histogram():
+    histogram = Histogram(unit=0.001)
+
+    assert histogram.percentile(50) is None
+
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000.)
+
+    assert histogram.count == 1000
+    assert histogram.min == 0.001
+    assert histogram.max == 1.0
+    assert abs(histogram.mean - 0.5005) < 1e-9
+
+    for percent, expected in [(50, 0.5), (90, 0.9), (99, 0.99), (100, 1.0)]:
+        assert expected <= histogram.percentile(percent) <= expected * 1.016
+
+    assert histogram.percentile(1) == 0.01
+
+    other = Histogram(unit=0.001)
+    other.record(5.0)
+    other.record(0)
+
+    merged = Histogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+    merged.merge(other)
+
+    assert merged.count == 1002
+    assert (merged.min, merged.max) == (0, 5.0)
+    assert merged.percentile(100) == 5.0
+    assert merged.percentile(50) == histogram.percentile(50)
@@ -1,4 +1,32 @@
-from memorytools.loop import main
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from memorytools.loop import main, run_command_or_code
+
+from utils import temp_directory
+
+
+def generator():
+    """ Returns a generator, which can not be sent back from the pool """
+    yield 1
+
+
+def sleep():
+    """ Returns a coroutine for the asyncio backend, without async syntax """
+    import asyncio
+    return asyncio.sleep(0.1)
+
+
+class Runs(object):
+    count = 0
+
+    @classmethod
+    def run(cls):
+        cls.count += 1
 
 
 def test_loop_command(runner):
@@ -22,3 +50,109 @@ def test_loop_code(runner):
     assert result.exit_code == 0
     assert 'Looped 10 times' in result.output
     assert 'with concurrency of 5 (50 runs' in result.output
+
+
+def test_run_command_or_code():
+    assert run_command_or_code('test_loop:Runs.run')
+    assert run_command_or_code('test_loop:Runs.run')
+    assert Runs.count == 2
+
+    assert run_command_or_code('json.decoder:JSONDecoder')
+    assert not run_command_or_code('json.decoder:missing')
+    assert run_command_or_code('x = 1; assert x == 1')
+    assert not run_command_or_code('x = 1; assert x == 2')
+    assert not run_command_or_code('false')
+    assert run_command_or_code('time.time(); subprocess.call("true")')
+    assert run_command_or_code('x = 2') and run_command_or_code('assert "x" not in globals()')
+
+
+def test_loop_pipelined(runner):
+    result = runner.invoke(main, ['print("Hello World!")', '1', '-c', 10, '-cc', 3, '--pipeline'])
+
+    assert result.exit_code == 0
+    assert 'Looped 10 times' in result.output
+    assert 'with concurrency of 3 pipelined' in result.output
+
+    start_time = time.time()
+    result = runner.invoke(main, ['print("Hello World!")', '1', '-c', 11, '-cc', 2, '--rate', 100])
+
+    assert result.exit_code == 0
+    assert 'Looped 11 times' in result.output
+    assert time.time() - start_time >= 0.1
+
+
+def test_loop_pipelined_with_failed_runs(runner):
+    result = runner.invoke(main, ['import sys; sys.exit(1)', '1', '-c', 5, '-cc', 2, '--pipeline'])
+
+    assert result.exit_code == 0
+    assert 'Looped 5 times' in result.output
+
+    result = runner.invoke(main, ['test_loop:generator', '1', '-c', 5, '-cc', 2, '--pipeline'])
+
+    assert result.exit_code == 0
+    assert 'Looped 5 times' in result.output
+
+
+def test_loop_stats(runner):
+    with temp_directory() as temp_dir:
+        json_file = os.path.join(temp_dir, 'stats.jsonl')
+        result = runner.invoke(main, ['import sys; sys.exit(1)', '1', '-c', 5, '-cc', 2, '-p', '--json', json_file])
+
+        assert result.exit_code == 0
+        assert 'Total: 5 runs, 5 errors, ' in result.output
+        assert ' runs per sec, latency (ms) p50 ' in result.output
+
+        with open(json_file) as fp:
+            stats = json.loads(fp.read().splitlines()[-1])
+
+        assert stats['final']
+        assert (stats['runs'], stats['errors']) == (5, 5)
+        assert sorted(stats['latency']) == ['max', 'mean', 'p50', 'p90', 'p99']
+
+
+def test_loop_watch_pid(runner, monkeypatch):
+    private = [10 * 1024 ** 2]
+
+    def get_pid_stats(pid):
+        private[0] += 2048
+        return {'rss': 2 * private[0], 'private': private[0]}
+
+    monkeypatch.setattr('memorytools.show_mem._get_pid_stats', get_pid_stats)
+
+    result = runner.invoke(main, ['x = 1', '0.01', '--watch-pid', '123', '--stop-on-leak'])
+
+    assert result.exit_code == 0
+    assert 'Iteration 1: PID 123 (MB):        20.01 rss        10.00 private (2.00 KB per iteration)' in result.output
+    assert 'Stopping as private of PID 123 grows significantly' in result.output
+    assert 'Looped 9 times' in result.output
+    assert 'Memory of PID 123: private grew 2.00 +/- 0.00 KB per iteration over 10 samples (significant)' in result.output
+
+    result = runner.invoke(main, ['x = 1', '0.01', '-c', 2, '--watch-pid', str(os.getpid())])
+
+    assert result.exit_code == 0
+    assert 'Iteration 2: PID %d (MB): ' % os.getpid() in result.output
+    assert 'Memory of PID %d: ' % os.getpid() in result.output
+
+
+def test_loop_thread_backend(runner):
+    count = Runs.count
+    result = runner.invoke(main, ['test_loop:Runs.run', '0.01', '-c', 5, '-cc', 2, '--backend', 'thread'])
+
+    assert result.exit_code == 0
+    assert 'Total: 10 runs, 0 errors, ' in result.output
+    assert Runs.count == count + 10
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason='asyncio backend requires Python 3.5')
+def test_loop_asyncio_backend(runner):
+    start_time = time.time()
+    result = runner.invoke(main, ['test_loop:sleep', '0.01', '-c', 1000, '-cc', 500, '-p', '--backend', 'asyncio'])
+
+    assert result.exit_code == 0
+    assert 'Total: 1000 runs, 0 errors, ' in result.output
+    assert time.time() - start_time < 5
+
+    result = runner.invoke(main, ['import sys; sys.exit(1)', '0.01', '-c', 2, '-cc', 2, '--backend', 'asyncio'])
+
+    assert result.exit_code == 0
+    assert 'Total: 4 runs, 4 errors, ' in result.output
@@ -1,8 +1,17 @@
+import os
+import signal
 import sys
+import threading
+import time
 
 from mock import patch, call
 
-from memorytools import save_objects
+from memorytools import (add_debug_handler, save_objects, take_snapshot, diff_snapshots, get_objects_by_id, TypeDelta,
+                         sample_objects, IncrementalSummary, summarize_objects, deep_sizes, find_referrer_chains,
+                         start_monitor, HeapMonitor, ObjectsSnapshot, TypeTrend, _summarize_objects, GrowthAlert,
+                         Alert, start_watchdog, _str, _describe_reference)
+
+from utils import temp_directory
 
 
 @patch('os.getpid', return_value=12345)
@@ -57,3 +66,326 @@ def test_save_objects(mocked_open, mocked_getpid):
             call("IDX 0: 24 <type 'int'> 1\n"),
             call("IDX 10: 16 <type 'object'> %s\n" % str(obj))
         ]
+
+
+@patch('os.getpid', return_value=12345)
+@patch('memorytools.open')
+def test_save_objects_with_limit(mocked_open, mocked_getpid):
+    big_dict = dict((i, 'value %d' % i) for i in range(1000))
+    objects = [1, 'string', big_dict, list(range(100)), 1.0]
+
+    summary = save_objects(objects, limit=2, max_len=20)
+
+    assert summary.startswith('Wrote top 2 of 5 objects to /var/tmp/objects-12345 (')
+
+    records = [c[0][0] for c in mocked_open().__enter__().write.call_args_list if c[0][0].startswith('IDX ')]
+    assert len(records) == 2
+    assert records[0].startswith('IDX 2: %d ' % sys.getsizeof(big_dict))
+    assert records[0].endswith("{0: 'value 0', 1: 'v...\n")
+    assert records[1].startswith('IDX 3: %d ' % sys.getsizeof(objects[3]))
+
+
+def test_str_with_max_len():
+    assert _str(list(range(10)), 100) == '[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]'
+    assert _str({'key': 'a long value that is longer than 30 characters'}, 100) == \
+        "{'key': 'a long value that is longer than 30 characters'}"
+    assert _str(list(range(100)), 20) == '[0, 1, 2, 3, 4, ...]'
+    assert _str(list(range(1000)), 100).endswith('...]')
+
+
+def test_diff_snapshots():
+    class Leak(object):
+        pass
+
+    objects = [Leak(), {'hello': 'world'}, [1, 2]]
+    before = take_snapshot(objects, track_ids=True)
+
+    leaks = [Leak(), Leak()]
+    objects = objects[:1] + leaks + [[1, 2]]
+    after = take_snapshot(objects, track_ids=True)
+
+    diff = diff_snapshots(before, after)
+
+    assert diff.types == [TypeDelta(Leak, 2, 2 * sys.getsizeof(leaks[0])),
+                          TypeDelta(dict, -1, -sys.getsizeof({'hello': 'world'}))]
+    assert diff.new_ids == set(id(o) for o in objects[1:])
+    assert get_objects_by_id(diff.new_ids, objects) == objects[1:]
+
+    assert diff_snapshots(take_snapshot(objects), after).new_ids is None
+
+
+def test_summarize_objects_by_type():
+    objects = [1, 2, 'string', {'hello': 'world'}, [1], [1, 2, 3]]
+
+    assert _summarize_objects(objects) == {
+        int: {'count': 2, 'size': sys.getsizeof(1) + sys.getsizeof(2)},
+        str: {'count': 1, 'size': sys.getsizeof('string')},
+        dict: {'count': 1, 'size': sys.getsizeof(objects[3])},
+        list: {'count': 2, 'size': sys.getsizeof(objects[4]) + sys.getsizeof(objects[5])},
+    }
+
+
+def test_sample_objects():
+    objects = [[i] for i in range(1000)] + [{'i': i} for i in range(1000)]
+
+    stats = sample_objects(1, objects)
+    assert stats == {
+        list: {'count': 1000, 'size': 1000 * sys.getsizeof([1]), 'count_error': 0, 'size_error': 0},
+        dict: {'count': 1000, 'size': 1000 * sys.getsizeof({'i': 1}), 'count_error': 0, 'size_error': 0},
+    }
+
+    stats = sample_objects(0.5, objects, strided=True)
+    assert stats[list]['count'] == stats[dict]['count'] == 1000
+    assert stats[list]['size'] == 1000 * sys.getsizeof([1])
+
+    stats = sample_objects(0.1, objects)
+    for kind in (list, dict):
+        assert abs(stats[kind]['count'] - 1000) <= stats[kind]['count_error'] * 3
+        assert stats[kind]['count_error'] > 0
+
+
+def test_incremental_summary():
+    objects = [1, 'string', {'hello': 'world'}, [1], [1, 2, 3]] * 10
+    summary = IncrementalSummary(objects, slice_size=7)
+
+    assert not summary.step(budget=0)
+    assert summary.position == 7
+
+    while not summary.step():
+        pass
+
+    assert summary.done
+    assert summary.stats == _summarize_objects(objects)
+    assert 'list' in summary.summarize(echo=False)
+
+
+def test_deep_sizes():
+    strings = dict(('key %d' % i, 'value %d' % i) for i in range(10))
+    inner = [strings, 'inner string']
+    outer = [inner]
+
+    sizes = deep_sizes([outer, inner, strings])
+
+    strings_size = sys.getsizeof(strings) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in strings.items())
+    inner_size = sys.getsizeof(inner) + sys.getsizeof('inner string')
+
+    assert sizes[id(strings)] == (strings_size, strings_size)
+    assert sizes[id(inner)] == (inner_size, inner_size + strings_size)
+    assert sizes[id(outer)] == (sys.getsizeof(outer), sys.getsizeof(outer) + inner_size + strings_size)
+
+    stats = _summarize_objects([outer, inner, strings], deep=True)
+    assert stats[list]['exclusive_size'] == sys.getsizeof(outer) + inner_size
+    assert stats[dict]['inclusive_size'] == strings_size
+
+    summary = summarize_objects([outer, inner, strings], echo=False, deep=True)
+    assert ' Inclusive  Exclusive Count Type' in summary
+
+    assert _summarize_objects([outer, inner, strings], deep=True, objs_deep_sizes=sizes) == stats
+
+
+def test_deep_sizes_exclude_shared_objects():
+    class User(object):
+        def __init__(self):
+            self.name = 'user name'
+            self.tags = ['tag']
+
+        def tag(self):
+            return self.tags
+
+    user = User()
+    method = user.tag
+    attrs_size = sum(sys.getsizeof(obj) for obj in [user.name, user.tags, user.tags[0], user.__dict__] + list(vars(user)))
+
+    # Not the class, its methods, or the module of the test and everything it reaches
+    assert deep_sizes([user])[id(user)][1] <= sys.getsizeof(user) + attrs_size
+    assert deep_sizes([method])[id(method)][1] <= sys.getsizeof(method) + sys.getsizeof(user) + attrs_size
+
+    assert deep_sizes([User])[id(User)][1] > sys.getsizeof(User)
+
+    try:
+        summarize_objects([user], sample=0.5, deep=True)
+        assert False, 'Deep sizes are not supported with sample'
+    except ValueError:
+        pass
+
+
+def test_deep_sizes_of_deep_graph():
+    head = None
+    for i in range(100000):
+        head = [head]
+
+    assert deep_sizes([head])[id(head)][1] == 100000 * sys.getsizeof(head) + sys.getsizeof(None)
+
+
+class Leak(object):
+    pass
+
+
+class FrameLeak(Leak):
+    pass
+
+
+LEAKS = {'leaks': [Leak()]}
+
+
+class ClassLeak(Leak):
+    pass
+
+
+class Registry(object):
+    leaks = {'class_leak': ClassLeak()}
+
+
+def test_find_referrer_chains():
+    chains = find_referrer_chains(Leak, echo=False)
+
+    assert chains == ["<module 'test_objects'>.__dict__['LEAKS']['leaks'][0] -> %s" % Leak]
+
+    assert find_referrer_chains(Leak, max_depth=2, echo=False) == []
+    assert find_referrer_chains(lambda obj: obj is LEAKS['leaks'], echo=False) == [
+        "<module 'test_objects'>.__dict__['LEAKS']['leaks'] -> %s" % list]
+
+
+def test_find_referrer_chains_from_class():
+    chains = find_referrer_chains(ClassLeak, echo=False)
+
+    assert chains == ["<module 'test_objects'>.__dict__['Registry'].__dict__['leaks']['class_leak'] -> %s" % ClassLeak]
+    assert _describe_reference(Registry, object()) == '.<? object>'
+
+
+def test_find_referrer_chains_from_frame():
+    local_leak = FrameLeak()  # noqa
+
+    chains = find_referrer_chains(FrameLeak, echo=False)
+
+    assert len(chains) == 1
+    assert chains[0].startswith('<frame test_find_referrer_chains_from_frame at ')
+    assert chains[0].endswith(".f_locals['local_leak'] -> %s" % FrameLeak)
+
+
+def test_monitor_trends():
+    monitor = HeapMonitor(history=3)
+
+    for i in range(5):
+        monitor.history.append(ObjectsSnapshot(100 + i * 10, {
+            dict: {'count': 10 + i * 2, 'size': 1000 + i * 200},
+            list: {'count': 5, 'size': 500}}, None))
+
+    assert len(monitor.history) == 3
+    assert monitor.trends() == [TypeTrend(dict, 0.2, 20.0), TypeTrend(list, 0.0, 0.0)]
+
+
+def test_start_monitor():
+    monitor = start_monitor(interval=0.01, history=2, sample=0.5)
+
+    try:
+        for _ in range(500):
+            if len(monitor.history) == 2:
+                break
+            time.sleep(0.01)
+
+        assert len(monitor.history) == 2
+        assert dict in monitor.history[-1].stats
+
+    finally:
+        monitor.stop()
+
+    assert not monitor.is_alive()
+
+
+def test_growth_alert():
+    alert = GrowthAlert('rss', limit=100, cooldown=60, hysteresis=0.1)
+
+    assert [alert.check(value, now) for now, value in [(0, 50), (1, 100), (2, 150), (3, 95), (4, 89), (5, 120)]] == [
+        None, Alert('rss', 100, None), None, None, None, None]
+    assert alert.check(120, now=61) == Alert('rss', 120, None)
+
+    alert = GrowthAlert('private', rate=10, window=3, cooldown=0)
+
+    assert [alert.check(value, now) for now, value in enumerate([0, 5, 10, 15, 60, 70, 70, 70, 100])] == [
+        None, None, None, None, Alert('private', 60, 25.0), None, None, None, Alert('private', 100, 15.0)]
+
+
+def test_start_watchdog():
+    leaks = []
+    alerts = []
+
+    class Leak(object):
+        pass
+
+    watchdog = start_watchdog(limit=3, kind=Leak, interval=0.01, callback=alerts.append)
+
+    try:
+        for _ in range(500):
+            if alerts:
+                break
+            leaks.append(Leak())
+            time.sleep(0.01)
+
+        assert len(alerts) == 1
+        assert alerts[0].name == str(Leak)
+        assert alerts[0].value >= 3
+
+    finally:
+        watchdog.stop()
+
+    assert not watchdog.is_alive()
+
+
+def test_add_debug_handler_with_summary():
+    original_handler = signal.getsignal(signal.SIGUSR1)
+
+    def slow_summary(*args, **kwargs):
+        time.sleep(0.2)
+
+    try:
+        with patch('memorytools.summarize_objects', side_effect=slow_summary) as mocked_summarize, \
+                patch('memorytools.save_objects') as mocked_save:
+            add_debug_handler(signal.SIGUSR1, log_stack=False, log_summary=True, save={'binary': True})
+
+            for _ in range(3):
+                os.kill(os.getpid(), signal.SIGUSR1)
+                time.sleep(0.01)
+
+            time.sleep(0.5)
+
+        assert mocked_summarize.call_count == 1
+        mocked_save.assert_called_once_with(binary=True)
+
+    finally:
+        signal.signal(signal.SIGUSR1, original_handler)
+
+
+def test_add_debug_handler_with_all_threads():
+    original_handler = signal.getsignal(signal.SIGUSR1)
+    done = threading.Event()
+    threads = [threading.Thread(target=done.wait, name='waiter-%d' % i) for i in range(2)]
+
+    try:
+        for thread in threads:
+            thread.start()
+
+        with temp_directory() as temp_dir:
+            stacks_file = os.path.join(temp_dir, 'stacks')
+            add_debug_handler(signal.SIGUSR1, all_threads=True, stacks_file=stacks_file)
+
+            with patch('memorytools.log') as mocked_log:
+                for _ in range(2):
+                    os.kill(os.getpid(), signal.SIGUSR1)
+
+            stacks = mocked_log.info.call_args[0][1]
+            assert '2 threads (waiter-0, waiter-1):\n' in stacks
+            assert '1 thread (MainThread):\n' in stacks
+            assert 'in test_add_debug_handler_with_all_threads\n' in stacks
+
+            with open(stacks_file) as fp:
+                collapsed = fp.read().splitlines()
+
+            waiters = [line for line in collapsed if line.endswith(' 2')]
+            assert len(waiters) == 2
+            assert waiters[0].startswith('_bootstrap (')
+            assert 'wait (' in waiters[0]
+
+    finally:
+        done.set()
+        signal.signal(signal.SIGUSR1, original_handler)
@@ -0,0 +1,35 @@
+import os
+
+from memorytools.recorder import HOUR, leak_rates, open_recorder, read_samples
+
+from utils import temp_directory
+
+
+def test_recorder():
+    samples = [(1000.0 + i * 60, {'commit_used': 1000 + i * 10, 'pid.12.rss': 500 - i}) for i in range(5)]
+
+    with temp_directory() as temp_dir:
+        for name in ('samples.jsonl', 'samples.csv'):
+            path = os.path.join(temp_dir, name)
+
+            for sample_time, series in samples:
+                recorder = open_recorder(path)
+                recorder.record(sample_time, series)
+                recorder.close()
+
+            assert list(read_samples(path)) == samples
+
+        path = os.path.join(temp_dir, 'samples.ring')
+        recorder = open_recorder(path, ring_size=3)
+        for sample_time, series in samples:
+            recorder.record(sample_time, {'rss': series['pid.12.rss']})
+        recorder.close()
+
+        assert list(read_samples(path)) == [(sample_time, {'rss': series['pid.12.rss']})
+                                            for sample_time, series in samples[2:]]
+
+    count, duration, rates = leak_rates(samples)
+
+    assert (count, duration) == (5, 240)
+    assert [(name, round(rate)) for name, rate, _ in rates] == [('commit_used', 10 * HOUR / 60),
+                                                                ('pid.12.rss', -HOUR / 60)]
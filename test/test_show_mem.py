@@ -1,5 +1,11 @@
 from collections import namedtuple
-from memorytools.show_mem import main, KB, MB
+from io import BytesIO
+import os
+
+from mock import patch
+
+from memorytools import show_mem
+from memorytools.show_mem import main, KB, MB, _get_cgroup_stats, _parse_smaps, _parse_smaps_mappings
 
 from utils import temp_directory
 
@@ -30,16 +36,330 @@ def test_show_mem(runner, monkeypatch):
                                 'Physical Mem (MB):        100.00 total       40.00 used (delta: 10.00)\n'
 
 
+def test_show_mem_physical_used(runner, monkeypatch):
+    with temp_directory() as temp_dir:
+        monkeypatch.setattr('tempfile.gettempdir', lambda: temp_dir)
+        monkeypatch.setattr('memorytools.show_mem.show_commit_stats', lambda: None)
+        monkeypatch.setattr('memorytools.show_mem._get_meminfo',
+                            lambda: 'MemTotal:    {0} kB\nMemFree:    {1} kB\nMemAvailable:    {2} kB\n'
+                                    'Buffers:    {3} kB\nCached:    {4} kB\nSReclaimable:    {3} kB'.format(
+                                        100 * KB, 10 * KB, 50 * KB, 5 * KB, 25 * KB))
+
+        result = runner.invoke(main)
+
+        # Used is MemTotal - MemFree - Buffers - Cached, ignoring MemAvailable and SReclaimable
+        assert result.exit_code == 0
+        assert result.output == 'Physical Mem (MB):        100.00 total       60.00 used \n'
+
+
 def test_show_mem_process(runner, monkeypatch):
     MemStats = namedtuple('MemStats', ['rss'])
+    pid = os.getpid()
 
     with temp_directory() as temp_dir:
         monkeypatch.setattr('tempfile.gettempdir', lambda: temp_dir)
         monkeypatch.setattr('psutil.Process.memory_info', lambda pid: MemStats(30 * MB))
-        monkeypatch.setattr('memorytools.show_mem._get_smaps',
-                            lambda pid: 'Private_Clean:    {0} kB\nPrivate_Dirty:    {1} kB'.format(100 * KB, 90 * KB))
+        monkeypatch.setattr('memorytools.show_mem._get_smaps', lambda pid: BytesIO(
+            'Private_Clean:    {0} kB\nPrivate_Dirty:    {1} kB'.format(100 * KB, 90 * KB).encode()))
+
+        result = runner.invoke(main, ['-p', str(pid)])
+
+        assert result.exit_code == 0
+        assert result.output == 'PID {0:5d} (MB):            30.00 rss        190.00 private\n'.format(pid)
+
+
+def test_parse_smaps():
+    smaps = BytesIO(b'00400000-7ffef7ccf000 ---p 00000000 00:00 0    [rollup]\n'
+                    b'Rss:                1392 kB\n'
+                    b'Pss:                 472 kB\n'
+                    b'Pss_Anon:            100 kB\n'
+                    b'Private_Clean:        48 kB\n'
+                    b'Private_Dirty:       100 kB\n'
+                    b'Private_Hugetlb:       2 kB\n'
+                    b'Swap:                  8 kB\n'
+                    b'SwapPss:               4 kB\n')
+
+    with patch('memorytools.show_mem.SMAPS_CHUNK_SIZE', 10):
+        assert _parse_smaps(smaps) == {'rss': 1392 * KB, 'pss': 472 * KB, 'private': 150 * KB, 'swap': 8 * KB}
+
+
+def test_parse_smaps_mappings(runner, monkeypatch):
+    smaps = (b'55d0c1a00000-55d0c1c00000 rw-p 00000000 00:00 0                          [heap]\n'
+             b'Rss:                2048 kB\n'
+             b'Pss:                2048 kB\n'
+             b'Private_Dirty:      2048 kB\n'
+             b'Swap:                  0 kB\n'
+             b'VmFlags: rd wr mr mw me ac sd\n'
+             b'7f2c4e600000-7f2c4e700000 r-xp 00000000 08:01 1234                       /usr/lib/libc.so.6\n'
+             b'Rss:                 800 kB\n'
+             b'Pss:                 100 kB\n'
+             b'Private_Clean:        16 kB\n'
+             b'Swap:                  0 kB\n'
+             b'7f2c4e800000-7f2c4e900000 rw-p 00000000 00:00 0 \n'
+             b'Rss:                 512 kB\n'
+             b'Pss:                 512 kB\n'
+             b'Private_Dirty:       500 kB\n'
+             b'Swap:                 12 kB\n'
+             b'7f2c4e900000-7f2c4ea00000 rw-p 00000000 00:00 0 \n'
+             b'Rss:                  12 kB\n'
+             b'Pss:                  12 kB\n'
+             b'Private_Dirty:        12 kB\n'
+             b'Swap:                  0 kB\n')
+
+    stats, maps = _parse_smaps_mappings(BytesIO(smaps))
+
+    assert stats == {'rss': 3372 * KB, 'pss': 2672 * KB, 'private': 2576 * KB, 'swap': 12 * KB}
+    assert maps == {'[heap]': {'count': 1, 'rss': 2048 * KB, 'pss': 2048 * KB, 'private': 2048 * KB, 'swap': 0},
+                    '/usr/lib/libc.so.6': {'count': 1, 'rss': 800 * KB, 'pss': 100 * KB, 'private': 16 * KB, 'swap': 0},
+                    '[anon]': {'count': 2, 'rss': 524 * KB, 'pss': 524 * KB, 'private': 512 * KB, 'swap': 12 * KB}}
+
+    # Lines split across chunks
+    monkeypatch.setattr('memorytools.show_mem.SMAPS_CHUNK_SIZE', 7)
+    assert _parse_smaps_mappings(BytesIO(smaps)) == (stats, maps)
+    assert _parse_smaps_mappings(BytesIO(smaps.rstrip())) == (stats, maps)
+
+    monkeypatch.setattr('memorytools.show_mem._get_smaps', lambda pid, rollup: BytesIO(smaps))
+    monkeypatch.setattr('memorytools.show_mem.MAPS_LIMIT', 2)
+
+    result = runner.invoke(main, ['-p', '12', '--maps'])
+
+    assert result.exit_code == 0
+    assert result.output == ('PID    12 (MB):             3.29 rss          2.61 pss          2.52 private        0.01 swap \n'
+                             '  Top 2 of 3 mappings by private (MB):\n'
+                             '     private        rss        pss       swap  count  mapping\n'
+                             '        2.00       2.00       2.00       0.00      1  [heap]\n'
+                             '        0.50       0.51       0.51       0.01      2  [anon]\n')
 
-        result = runner.invoke(main, ['-p', '123'])
+
+def test_show_mem_all_processes(runner, monkeypatch):
+    Process = namedtuple('Process', ['pid', 'info'])
+    processes = [Process(pid, {'name': 'gunicorn'}) for pid in (10, 11, 12)]
+    processes += [Process(13, {'name': 'python'}), Process(14, {'name': None})]
+
+    monkeypatch.setattr('psutil.process_iter', lambda attrs: processes)
+    monkeypatch.setattr('memorytools.show_mem._get_pid_stats',
+                        lambda pid: {'rss': pid * MB, 'private': (pid - 5) * MB})
+
+    result = runner.invoke(main, ['-p', 'gunicorn', '--all'])
+
+    assert result.exit_code == 0
+    assert result.output == ('3 processes matching "gunicorn":\n'
+                             '  PID    10 (MB):          10.00 rss          5.00 private\n'
+                             '  PID    11 (MB):          11.00 rss          6.00 private\n'
+                             '  PID    12 (MB):          12.00 rss          7.00 private\n'
+                             '  Total (MB):              33.00 rss         18.00 private\n')
+
+    result = runner.invoke(main, ['-p', 'gunicorn', '--top', '1'])
+
+    assert result.exit_code == 0
+    assert result.output == ('3 processes matching "gunicorn" (showing top 1 by rss):\n'
+                             '  PID    12 (MB):          12.00 rss          7.00 private\n'
+                             '  Total (MB):              33.00 rss         18.00 private\n')
+
+    result = runner.invoke(main, ['-p', 'gunicorn'])
+
+    assert result.exit_code == 0
+    assert result.output == ('3 processes matching "gunicorn" (showing 1st & last):\n'
+                             '  PID    10 (MB):          10.00 rss          5.00 private\n'
+                             '  PID    12 (MB):          12.00 rss          7.00 private\n')
+
+
+def test_show_mem_watch(runner, monkeypatch):
+    used = [30, 35, 32]
+
+    def sleep(secs):
+        used.pop(0)
+        if len(used) == 1:
+            raise KeyboardInterrupt
+
+    with temp_directory() as temp_dir:
+        monkeypatch.setattr('tempfile.gettempdir', lambda: temp_dir)
+        monkeypatch.setattr('time.sleep', sleep)
+        monkeypatch.setattr('memorytools.show_mem._get_meminfo',
+                            lambda: 'MemTotal:    {0} kB\nMemFree:    {1} kB\nBuffers:    0 kB\nCached:    {1} kB'.format(
+                                100 * KB, (100 - used[0]) * KB // 2))
+        monkeypatch.setattr('memorytools.show_mem.show_commit_stats', lambda: None)
+
+        result = runner.invoke(main, ['--watch', '0.01'])
 
         assert result.exit_code == 0
-        assert result.output == 'PID   123 (MB):            30.00 rss        190.00 private\n'
+        assert result.output == 'Physical Mem (MB):        100.00 total       30.00 used \n\n' \
+                                'Physical Mem (MB):        100.00 total       35.00 used (delta: 5.00)\n'
+        assert os.listdir(temp_dir) == []
+
+
+def test_show_mem_watch_closes_files_of_gone_processes(runner, monkeypatch):
+    samples = [[10, 11], [11, 12, 13], [13]]
+    files = {}
+    open_pids = []
+    pools = []
+
+    def find_pids(name):
+        return samples[0]
+
+    def get_smaps(pid, rollup=True):
+        fp = show_mem._open_proc(os.path.join(temp_dir, str(pid)))
+        files[pid] = fp
+        return fp
+
+    def sleep(secs):
+        open_pids.append(sorted(int(os.path.basename(path)) for path in show_mem._proc_files))
+        pools.append(show_mem._pool)
+        samples.pop(0)
+        if not samples:
+            raise KeyboardInterrupt
+
+    with temp_directory() as temp_dir:
+        for pid in range(10, 14):
+            with open(os.path.join(temp_dir, str(pid)), 'w') as fp:
+                fp.write('Rss:    {0} kB\nPrivate_Dirty:    {0} kB\n'.format(pid * KB))
+
+        monkeypatch.setattr('time.sleep', sleep)
+        monkeypatch.setattr('memorytools.show_mem._find_pids', find_pids)
+        monkeypatch.setattr('memorytools.show_mem._get_smaps', get_smaps)
+
+        result = runner.invoke(main, ['-p', 'gunicorn', '-a', '--watch', '0.01'])
+
+        assert result.exit_code == 0
+        assert open_pids == [[10, 11], [11, 12, 13], [13]]
+        assert pools[0] and pools.count(pools[0]) == len(pools)
+        assert all(fp.closed for fp in files.values())
+        assert show_mem._proc_files is None and show_mem._pool is None
+
+
+def test_show_mem_record(runner, monkeypatch):
+    used = [30, 35, 40]
+    now = [0]
+
+    def sleep(secs):
+        used.pop(0)
+        now[0] += 360
+        if not used:
+            raise KeyboardInterrupt
+
+    with temp_directory() as temp_dir:
+        path = os.path.join(temp_dir, 'samples.jsonl')
+
+        monkeypatch.setattr('time.sleep', sleep)
+        monkeypatch.setattr('time.time', lambda: now[0])
+        monkeypatch.setattr('memorytools.show_mem._get_meminfo',
+                            lambda: 'MemTotal:    {0} kB\nMemFree:    {1} kB\nBuffers:    0 kB\nCached:    {1} kB'.format(
+                                100 * KB, (100 - used[0]) * KB // 2))
+        monkeypatch.setattr('memorytools.show_mem.show_commit_stats', lambda: None)
+        monkeypatch.setattr('memorytools.show_mem._get_pid_stats', lambda pid: {'rss': 10 * MB, 'private': 5 * MB})
+
+        result = runner.invoke(main, ['-s', '-p', '12', '--watch', '360', '--record', path])
+        assert result.exit_code == 0
+
+        result = runner.invoke(main, ['--report', path])
+
+        assert result.exit_code == 0
+        assert result.output == ('3 samples over 0.20 hours in {0}:\n'
+                                 '  physical_used (MB/hour):           50.00 +/- 0.00\n'
+                                 '  pid.12.private (MB/hour):           0.00 +/- 0.00\n'
+                                 '  pid.12.rss (MB/hour):               0.00 +/- 0.00\n'
+                                 '  private (MB/hour):                  0.00 +/- 0.00\n'
+                                 '  rss (MB/hour):                      0.00 +/- 0.00\n').format(path)
+
+
+def test_show_mem_tree(runner, monkeypatch):
+    class Process(namedtuple('Process', ['pid'])):
+        def children(self, recursive):
+            return [Process(11), Process(12)]
+
+    monkeypatch.setattr('psutil.Process', Process)
+    monkeypatch.setattr('memorytools.show_mem._get_pid_stats',
+                        lambda pid: {'rss': 20 * MB, 'pss': pid * MB, 'private': (pid - 8) * MB, 'swap': 0})
+
+    result = runner.invoke(main, ['--tree', '10'])
+
+    assert result.exit_code == 0
+    assert result.output == ('3 processes in tree of PID 10:\n'
+                             '  PID    10 (MB):          20.00 rss         10.00 pss          2.00 private        0.00 swap \n'
+                             '  PID    11 (MB):          20.00 rss         11.00 pss          3.00 private        0.00 swap \n'
+                             '  PID    12 (MB):          20.00 rss         12.00 pss          4.00 private        0.00 swap \n'
+                             '  Total (MB):              33.00 pss          9.00 private        0.00 swap \n')
+
+
+def test_show_mem_cgroup(runner, monkeypatch):
+    def write(path, content):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(content)
+
+    with temp_directory() as temp_dir:
+        cgroup_dir = os.path.join(temp_dir, 'cgroup', 'docker', 'abc')
+        proc_cgroup = os.path.join(temp_dir, 'proc_cgroup')
+
+        monkeypatch.setattr('tempfile.gettempdir', lambda: temp_dir)
+        monkeypatch.setattr('memorytools.show_mem.CGROUP_ROOT', os.path.join(temp_dir, 'cgroup'))
+        monkeypatch.setattr('memorytools.show_mem.PROC_CGROUP', proc_cgroup)
+
+        write(proc_cgroup, '0::/docker/abc\n')
+        write(os.path.join(cgroup_dir, 'memory.current'), '{0}\n'.format(300 * MB))
+        write(os.path.join(cgroup_dir, 'memory.max'), '{0}\n'.format(512 * MB))
+        write(os.path.join(cgroup_dir, 'memory.stat'), 'anon {0}\nfile {1}\nkernel 4096\n'.format(200 * MB, 90 * MB))
+        write(os.path.join(cgroup_dir, 'memory.events'), 'low 0\nhigh 0\nmax 12\noom 1\noom_kill 1\n')
+
+        result = runner.invoke(main, ['--cgroup'])
+
+        assert result.exit_code == 0
+        assert result.output == ('Cgroup Mem (MB):          512.00 total      300.00 used \n'
+                                 'Cgroup Usage (MB):        200.00 anon        90.00 file \n'
+                                 'Cgroup Events:                 1 oom           1 oom_kill\n')
+
+        write(os.path.join(cgroup_dir, 'memory.current'), '{0}\n'.format(400 * MB))
+        write(os.path.join(cgroup_dir, 'memory.events'), 'low 0\nhigh 0\nmax 12\noom 2\noom_kill 2\n')
+
+        result = runner.invoke(main, ['--cgroup'])
+
+        assert result.exit_code == 0
+        assert result.output == ('Cgroup Mem (MB):          512.00 total      400.00 used (delta: 100.00)\n'
+                                 'Cgroup Usage (MB):        200.00 anon        90.00 file \n'
+                                 'Cgroup Events:                 2 oom (delta: 1)           2 oom_kill (delta: 1)\n')
+
+        # Cgroup v1 with the container's cgroup mounted as root and no limit
+        cgroup_dir = os.path.join(temp_dir, 'cgroup', 'memory')
+
+        write(proc_cgroup, '5:devices:/docker/abc\n4:memory:/docker/abc\n0::/\n')
+        write(os.path.join(cgroup_dir, 'memory.usage_in_bytes'), '{0}\n'.format(300 * MB))
+        write(os.path.join(cgroup_dir, 'memory.limit_in_bytes'), '9223372036854771712\n')
+        write(os.path.join(cgroup_dir, 'memory.stat'), 'cache 1\nrss 2\ntotal_cache {0}\ntotal_rss {1}\n'.format(
+            90 * MB, 200 * MB))
+        write(os.path.join(cgroup_dir, 'memory.oom_control'), 'oom_kill_disable 0\nunder_oom 0\noom_kill 3\n')
+
+        assert _get_cgroup_stats() == {'version': 1, 'current': 300 * MB, 'max': None, 'anon': 200 * MB,
+                                       'file': 90 * MB, 'oom_kill': 3}
+
+
+def test_show_mem_alert(runner, monkeypatch):
+    used = [30, 60, 20, 70]
+
+    def sleep(secs):
+        used.pop(0)
+        if not used:
+            raise KeyboardInterrupt
+
+    with temp_directory() as temp_dir:
+        alert_file = os.path.join(temp_dir, 'alert')
+
+        monkeypatch.setattr('time.sleep', sleep)
+        monkeypatch.setattr('memorytools.show_mem.show_commit_stats', lambda: None)
+        monkeypatch.setattr('memorytools.show_mem._get_meminfo',
+                            lambda: 'MemTotal:    {0} kB\nMemFree:    {1} kB'.format(100 * KB, (100 - used[0]) * KB))
+
+        result = runner.invoke(main, ['--watch', '1', '--alert', '50', '--alert-cooldown', '0',
+                                      '--alert-cmd', 'echo $MEMORYTOOLS_ALERT $MEMORYTOOLS_ALERT_VALUE >> ' + alert_file])
+
+        assert result.exit_code == 0
+        assert result.output.count('Alert: physical_used is 60.00 MB\n') == 1
+        assert result.output.count('Alert: physical_used is 70.00 MB\n') == 1
+
+        with open(alert_file) as fp:
+            assert fp.read() == 'physical_used {0}\nphysical_used {1}\n'.format(60 * MB, 70 * MB)
+
+    result = runner.invoke(main, ['--alert', '50'])
+
+    assert result.exit_code == 2
+    assert 'Alert requires --watch' in result.output
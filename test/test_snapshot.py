@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+from memorytools.snapshot import Snapshot, write_snapshot
+
+from utils import temp_directory
+
+
+def test_snapshot():
+    inner = ['goodbye', 'world']
+    objects = [{'hello': inner}, inner, 'string', 1.0]
+
+    with temp_directory() as temp_dir:
+        path = os.path.join(temp_dir, 'objects.snapshot')
+
+        total_size = write_snapshot(path, objects, referents=True)
+        assert total_size == sum(sys.getsizeof(o) for o in objects)
+
+        with Snapshot(path) as snapshot:
+            assert len(snapshot) == 4
+            assert snapshot.has_referents
+            assert snapshot.types == [str(dict), str(list), str(str), str(float)]
+
+            records = list(snapshot)
+            assert [(r.id, r.size, r.type) for r in records] == [(id(o), sys.getsizeof(o), str(type(o))) for o in objects]
+            assert snapshot[-1] == records[-1]
+
+            assert id(inner) in snapshot.referents(records[0])
+            assert set(snapshot.referents(records[1])) == set([id(inner[0]), id(inner[1])])
+            assert snapshot.referents(records[3]) == ()
+
+            assert [r.index for r in snapshot.filter(kind=list)] == [1]
+            assert [r.index for r in snapshot.filter(min_size=sys.getsizeof(inner))] == [0, 1]
+            assert list(snapshot.filter(kind=set)) == []
+
+            summary = snapshot.summarize(echo=False)
+            assert '1 %10s %s' % (sys.getsizeof(objects[0]), dict) in summary
+
+
+def test_snapshot_without_referents():
+    with temp_directory() as temp_dir:
+        path = os.path.join(temp_dir, 'objects.snapshot')
+        write_snapshot(path, [[1, 2]])
+
+        with Snapshot(path) as snapshot:
+            assert not snapshot.has_referents
+            assert snapshot.referents(snapshot[0]) == ()
+
+
+def test_snapshot_invalid_file():
+    with temp_directory() as temp_dir:
+        path = os.path.join(temp_dir, 'objects')
+        with open(path, 'wb') as fp:
+            fp.write(b'Objects count: 1\n' * 10)
+
+        with pytest.raises(ValueError):
+            Snapshot(path)
@@ -0,0 +1,45 @@
+import subprocess
+import sys
+
+import pytest
+
+#: Modules that console scripts should only import when needed, by the module that imports them
+LAZY_IMPORTS = {
+  'memorytools.show_mem': ['psutil', 'multiprocessing'],
+  'memorytools.loop': ['psutil', 'multiprocessing'],
+  'memorytools.coordinator': ['psutil', 'multiprocessing'],
+}
+
+
+def import_times(module):
+    """ :return: Dict of cumulative import time in microseconds by module name from `python -X importtime` """
+    output = subprocess.check_output([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                     stderr=subprocess.STDOUT, universal_newlines=True)
+    times = {}
+
+    for line in output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+
+    return times
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime requires Python 3.7')
+@pytest.mark.parametrize('module', sorted(LAZY_IMPORTS))
+def test_startup_imports(module):
+    times = import_times(module)
+
+    assert module in times
+    assert [m for m in LAZY_IMPORTS[module] if m in times] == []
+
+
+def test_startup_locale():
+    code = 'import locale, memorytools.show_mem; print(locale.setlocale(locale.LC_NUMERIC))'
+    assert subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).strip() == 'C'
+
+
+def test_startup_logging():
+    code = 'import logging, memorytools.show_mem; print(logging.root.handlers)'
+    assert subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).strip() == '[]'